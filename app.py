@@ -13,9 +13,21 @@ from pathlib import Path
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 DATA_FILE = Path(__file__).parent / "data.json"
+DB_FILE = Path(__file__).parent / "data.db"
 
 def _read_settings():
-    """data.json에서 설정 읽기"""
+    """data.db에서 설정 읽기 (DB가 아직 없으면 data.json 폴백)"""
+    try:
+        if DB_FILE.exists():
+            import sqlite3
+            conn = sqlite3.connect(str(DB_FILE), timeout=5)
+            try:
+                rows = conn.execute("SELECT key, value FROM settings").fetchall()
+            finally:
+                conn.close()
+            return {k: json.loads(v) for k, v in rows}
+    except Exception:
+        pass
     try:
         if DATA_FILE.exists():
             with open(DATA_FILE, "r", encoding="utf-8") as f:
@@ -0,0 +1,266 @@
+"""
+HLS playlist(M3U8) 재작성기
+CDN에서 받은 M3U8의 세그먼트 / 서브 playlist / #EXT-X-KEY 등 URI를 로컬 프록시 경로로 바꿉니다.
+정규식은 모듈 로드 시 한 번만 컴파일합니다. 본문은 parse()에서 한 번만 읽고, 재작성은 그때 기록한
+URI 줄 위치만 바꿔 한 번에 join합니다. (Playlist.render)
+
+- 기본 모드: /api/ts-proxy/s.ts?url=<퍼센트 인코딩된 원래 URL>
+- 압축 모드(compact_prefix 지정): <compact_prefix>/<index>.<ext> — 원래 URL은 반환되는 목록의 index 위치
+
+parse()는 본문을 Playlist 객체(화질 목록, 세그먼트 + 누적 시작 시각, 키, byte range, discontinuity)로 읽습니다.
+URI 번호(index)는 rewrite()가 반환하는 URL 목록의 위치와 같으므로 압축 경로 번호로 그대로 쓸 수 있습니다.
+"""
+import re
+from bisect import bisect_left, bisect_right
+from urllib.parse import quote, urljoin
+
+PROXY_PREFIX = "/api/ts-proxy/s.ts?url="
+
+_URI_ATTR_RE = re.compile(r'URI="([^"]+)"')
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+# 압축 경로에서 URI 속성의 확장자를 URL로 알 수 없을 때 태그별 기본값 (ffmpeg가 확장자로 형식을 추측)
+_TAG_DEFAULT_EXT = {
+    "#EXT-X-KEY": ".key",
+    "#EXT-X-SESSION-KEY": ".key",
+    "#EXT-X-MAP": ".mp4",
+    "#EXT-X-MEDIA": ".m3u8",
+    "#EXT-X-I-FRAME-STREAM-INF": ".m3u8",
+    "#EXT-X-RENDITION-REPORT": ".m3u8",
+}
+_EXT_RE = re.compile(r'\.(m3u8|ts|m4s|mp4|m4a|aac|key|vtt)$', re.IGNORECASE)
+
+
+def proxy_ext(url, default=".ts"):
+    """압축 경로에 붙일 확장자 (ffmpeg 등이 확장자로 형식을 추측하므로 유지)."""
+    m = _EXT_RE.search(url.split('?', 1)[0].split('#', 1)[0])
+    return "." + m.group(1).lower() if m else default
+
+
+def _tag_default_ext(line):
+    """URI 속성이 있는 태그 줄의 기본 확장자. (모르는 태그는 세그먼트로 봄)"""
+    return _TAG_DEFAULT_EXT.get(line.split(':', 1)[0], ".ts")
+
+
+def _absolutizer(base_url):
+    """playlist URL 기준 절대 URL 변환 함수. 흔한 경우(절대 URL, 같은 폴더 파일명)는 urljoin 없이 처리."""
+    base_dir = base_url.split('?', 1)[0].split('#', 1)[0].rsplit('/', 1)[0] + '/'
+
+    def absolute(uri):
+        if uri.startswith(('http://', 'https://')):
+            return uri
+        if uri[0] not in '/.' and '://' not in uri:
+            return base_dir + uri
+        return urljoin(base_url, uri)
+    return absolute
+
+
+# ──────────────────────────────────────────────
+# 파싱된 playlist 모델
+# ──────────────────────────────────────────────
+def _attrs(line):
+    """#EXT-X-...:A=1,B="x,y" 속성 목록 → dict (따옴표 제거)."""
+    return {k: v.strip('"') for k, v in _ATTR_RE.findall(line.split(':', 1)[1] if ':' in line else '')}
+
+
+class Variant:
+    """master playlist의 화질 하나 (#EXT-X-STREAM-INF + 다음 URI 줄)."""
+    __slots__ = ("bandwidth", "resolution", "url", "index")
+
+    def __init__(self, bandwidth, resolution, url, index):
+        self.bandwidth = bandwidth
+        self.resolution = resolution
+        self.url = url
+        self.index = index
+
+
+class Segment:
+    """media playlist의 세그먼트 하나. key는 적용 중인 #EXT-X-KEY ({"method", "url", "iv"}) 또는 None,
+    byterange는 (길이, 시작 오프셋) 또는 None."""
+    __slots__ = ("url", "index", "start", "duration", "sequence", "key", "byterange", "discontinuity")
+
+    def __init__(self, url, index, start, duration, sequence, key=None, byterange=None, discontinuity=False):
+        self.url = url
+        self.index = index
+        self.start = start
+        self.duration = duration
+        self.sequence = sequence
+        self.key = key
+        self.byterange = byterange
+        self.discontinuity = discontinuity
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def range_header(self):
+        """byte range 세그먼트의 HTTP Range 헤더 값. 아니면 None."""
+        if not self.byterange:
+            return None
+        length, offset = self.byterange
+        return f"bytes={offset}-{offset + length - 1}"
+
+
+class Playlist:
+    """M3U8 한 개를 읽은 결과. master면 variants, media면 segments가 채워집니다."""
+
+    def __init__(self, url):
+        self.url = url
+        self.variants = []
+        self.segments = []
+        self.starts = []            # 세그먼트 시작 시각 (bisect용)
+        self.urls = []              # 등장 순서의 모든 URI (rewrite()의 URL 목록과 같은 순서)
+        self.lines = []             # 앞뒤 공백을 뺀 원본 줄
+        self.uri_lines = []         # URI가 있는 줄 번호 (URI 줄 또는 URI="..." 속성이 있는 태그 줄)
+        self.target_duration = 0.0
+        self.media_sequence = 0
+        self.endlist = False
+        self.duration = 0.0
+
+    @property
+    def is_master(self):
+        return bool(self.variants)
+
+    @property
+    def fixed(self):
+        """URI 번호가 바뀌지 않는 playlist인지 (VOD 또는 master). 라이브 media playlist는 갱신마다 밀림."""
+        return self.endlist or self.is_master
+
+    def render(self, compact_prefix=None):
+        """URI를 프록시 경로로 바꾼 본문. 파싱 때 기록한 URI 줄만 고치므로 본문을 다시 읽지 않습니다.
+        compact_prefix가 있으면 <compact_prefix>/<index>.<ext>, 없으면 PROXY_PREFIX + 인코딩된 URL."""
+        out = list(self.lines)
+        urls = self.urls
+        n = 0
+        if compact_prefix is None:
+            def proxied(default_ext):
+                nonlocal n
+                n += 1
+                return PROXY_PREFIX + quote(urls[n - 1], safe='')
+        else:
+            def proxied(default_ext):
+                nonlocal n
+                n += 1
+                return f"{compact_prefix}/{n - 1}{proxy_ext(urls[n - 1], default_ext)}"
+        for i in self.uri_lines:
+            line = out[i]
+            if line[0] != '#':
+                out[i] = proxied(".ts")
+            else:
+                default_ext = _tag_default_ext(line)
+                out[i] = _URI_ATTR_RE.sub(lambda m: 'URI="' + proxied(default_ext) + '"', line)
+        return '\n'.join(out)
+
+    def segment_at(self, t):
+        """t초를 포함하는 세그먼트. 범위를 벗어나면 None."""
+        i = bisect_right(self.starts, t) - 1
+        if i < 0 or t >= self.duration:
+            return None
+        return self.segments[i]
+
+    def segments_between(self, start, end):
+        """[start, end) 구간과 겹치는 세그먼트들 (이진 탐색)."""
+        lo = max(0, bisect_right(self.starts, start) - 1)
+        hi = bisect_left(self.starts, end)
+        return [seg for seg in self.segments[lo:hi] if seg.end > start]
+
+
+def parse(content, base_url):
+    """M3U8 본문 → Playlist. 상대 URL은 base_url 기준으로 절대 URL로 바꿉니다."""
+    pl = Playlist(base_url)
+    absolute = _absolutizer(base_url)
+    urls = pl.urls
+    pending_variant = None
+    duration = None
+    byterange = None
+    discontinuity = False
+    key = None
+    last_range_end = {}             # URL -> 직전 byte range 끝 (오프셋 생략 시 이어서)
+    pos = 0.0
+
+    lines = pl.lines
+    uri_lines = pl.uri_lines
+    for line in content.splitlines():
+        line = line.strip()
+        lines.append(line)
+        if not line:
+            continue
+        if line[0] != '#':
+            uri_lines.append(len(lines) - 1)
+            url = absolute(line)
+            urls.append(url)
+            index = len(urls) - 1
+            if pending_variant is not None:
+                bandwidth, resolution = pending_variant
+                pl.variants.append(Variant(bandwidth, resolution, url, index))
+                pending_variant = None
+            elif duration is not None:
+                if byterange is not None:
+                    length, offset = byterange
+                    if offset is None:
+                        offset = last_range_end.get(url, 0)
+                    byterange = (length, offset)
+                    last_range_end[url] = offset + length
+                pl.segments.append(Segment(url, index, pos, duration, pl.media_sequence + len(pl.segments),
+                                           key, byterange, discontinuity))
+                pl.starts.append(pos)
+                pos += duration
+                duration = None
+                byterange = None
+                discontinuity = False
+            continue
+
+        uri_start = len(urls)
+        if 'URI="' in line:
+            uri_lines.append(len(lines) - 1)
+            urls.extend(absolute(uri) for uri in _URI_ATTR_RE.findall(line))
+
+        if line.startswith('#EXTINF:'):
+            try:
+                duration = float(line[8:].split(',', 1)[0])
+            except ValueError:
+                duration = pl.target_duration
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = _attrs(line)
+            try:
+                bandwidth = int(attrs.get("BANDWIDTH", 0))
+            except ValueError:
+                bandwidth = 0
+            pending_variant = (bandwidth, attrs.get("RESOLUTION", ""))
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            length, _, offset = line[17:].partition('@')
+            try:
+                byterange = (int(length), int(offset) if offset else None)
+            except ValueError:
+                byterange = None
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = _attrs(line)
+            if attrs.get("METHOD", "NONE") == "NONE":
+                key = None
+            else:
+                key = {"method": attrs["METHOD"], "iv": attrs.get("IV"),
+                       "url": urls[uri_start] if len(urls) > uri_start else None}
+        elif line == '#EXT-X-DISCONTINUITY':
+            discontinuity = True
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            try:
+                pl.target_duration = float(line[22:])
+            except ValueError:
+                pass
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            try:
+                pl.media_sequence = int(line[22:])
+            except ValueError:
+                pass
+        elif line == '#EXT-X-ENDLIST':
+            pl.endlist = True
+
+    pl.duration = pos
+    return pl
+
+
+def rewrite(content, base_url, compact_prefix=None):
+    """M3U8 본문의 모든 URI를 프록시 경로로 바꿔 (재작성된 본문, 원래 URL 목록)을 반환합니다.
+    상대 URL은 base_url(보통 playlist 자신의 URL) 기준으로 절대 URL로 바꿉니다.
+    모델도 필요하면 parse() 후 Playlist.render()를 쓰면 본문을 한 번만 읽습니다."""
+    pl = parse(content, base_url)
+    return pl.render(compact_prefix), pl.urls
@@ -5,18 +5,29 @@ MissAV 등 P.A.C.K.E.R. 난독화 사이트는 커스텀 추출기로 폴백합
 """
 
 import os
+import sys
 import json
 import time
 import hashlib
 import re
+import gzip
+import base64
+import heapq
+import itertools
+import operator
+import sqlite3
 import threading
 import subprocess
 import urllib.parse
+from array import array
+from collections import deque, OrderedDict
+from queue import Queue, Empty, Full
 from pathlib import Path
 from flask import Flask, request, jsonify, render_template, Response, send_file, stream_with_context
 import yt_dlp
 import requests
 from bs4 import BeautifulSoup
+import playlist
 
 app = Flask(__name__)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # 정적 파일 캐시 비활성화
@@ -30,10 +41,31 @@ def _add_no_cache_headers(response):
         response.headers['Expires'] = '0'
     return response
 
+_GZIP_MIN_BYTES = 1400  # 이보다 작은 JSON은 압축 이득이 없음
+
+@app.after_request
+def _gzip_json_response(response):
+    """큰 JSON 응답을 gzip으로 압축합니다. (스트리밍/프록시 응답은 제외)"""
+    if (response.status_code != 200 or response.mimetype != "application/json"
+            or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or "gzip" not in request.headers.get("Accept-Encoding", "").lower()):
+        return response
+    data = response.get_data()
+    if len(data) < _GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers.add("Vary", "Accept-Encoding")
+    return response
+
 BASE_DIR = Path(__file__).parent
 COOKIES_FILE = BASE_DIR / "cookies.txt"
 DOWNLOADS_DIR = BASE_DIR / "downloads"
-DATA_FILE = BASE_DIR / "data.json"
+DATA_FILE = BASE_DIR / "data.json"   # 복구용 JSON 스냅샷
+DB_FILE = BASE_DIR / "data.db"        # 원본 저장소 (SQLite WAL)
+JOURNAL_FILE = BASE_DIR / "data.journal"  # 재생 위치/히트맵 이벤트 추가 전용 로그 (JSONL)
+SEGMENT_CACHE_DIR = BASE_DIR / "segment_cache"  # HLS 세그먼트 디스크 캐시
 
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 
@@ -76,8 +108,7 @@ class BrowseAPI:
 
         uid = _url_id(url)
         # 중복 체크 먼저
-        data = _load_data()
-        if any(item["id"] == uid for item in data["queue"]):
+        if _queue_find(uid):
             return {"error": "이미 대기열에 있습니다.", "duplicate": True, "title": url}
 
         # 추출 시도 (최대 2회 재시도)
@@ -109,30 +140,22 @@ class BrowseAPI:
         }
 
         # 다시 한번 중복 체크 (추출 중 다른 곳에서 추가되었을 수 있음)
-        data = _load_data()
-        if any(item["id"] == uid for item in data["queue"]):
+        if not _queue_add(entry):
             return {"error": "이미 대기열에 있습니다.", "duplicate": True, "title": entry["title"]}
-        data["queue"].append(entry)
-        _save_data(data)
 
-        # 저장 검증
-        verify = _load_data()
-        saved = any(item["id"] == uid for item in verify["queue"])
-        if not saved:
-            return {"error": "저장 실패 — 다시 시도해 주세요.", "save_failed": True}
+        if not entry["stream_url"]:
+            _preextract_enqueue([(uid, url)], _PRE_PRIO_NEW)
 
         print(f"  [탐색창] 대기열 추가: {entry['title'][:60]}")
         return {"ok": True, "title": entry["title"], "id": uid}
 
     def get_queue_urls(self):
         """대기열에 있는 URL 목록을 반환합니다. (JS에서 호출)"""
-        data = _load_data()
-        return [item["url"] for item in data["queue"]]
+        return [item["url"] for item in _queue_items()]
 
     def get_queue_count(self):
         """대기열 항목 수를 반환합니다. (JS에서 호출)"""
-        data = _load_data()
-        return len(data["queue"])
+        return len(_queue_ids())
 
     def open_new_tab(self, url):
         """새 탐색 창(탭)을 열어 지정 URL로 이동합니다. (JS에서 호출)"""
@@ -890,13 +913,89 @@ def _get_browser():
     return _detected_browser
 
 
+# ── 브라우저 쿠키 jar 캐시 ──
+# 브라우저 쿠키 DB 복호화는 수백 ms가 걸리므로, 추출한 jar(CUSTOM_DOMAINS 쿠키만)를 메모리에 두고
+# 쿠키 DB 파일 mtime 변경 / cf_clearance 만료 / /api/cookies/extract 호출 때만 다시 추출합니다.
+_COOKIE_JAR_MAX_AGE = 600   # 쿠키 DB 위치를 모를 때 재추출 주기(초)
+_cookie_jar_lock = threading.Lock()
+_cookie_jar_cache = None    # {"browser", "jar", "name", "mtime", "cf_expires", "loaded_at"}
+
+def _browser_cookie_db_paths(browser):
+    """브라우저 쿠키 DB 후보 경로 (Chromium 계열은 Network/Cookies, 구버전 Cookies)."""
+    local = os.environ.get('LOCALAPPDATA', '')
+    roaming = os.environ.get('APPDATA', '')
+    chromium_dirs = {
+        'edge': [os.path.join(local, 'Microsoft', 'Edge', 'User Data')],
+        'chrome': [os.path.join(local, 'Google', 'Chrome', 'User Data')],
+        'brave': [os.path.join(local, 'BraveSoftware', 'Brave-Browser', 'User Data')],
+        'chromium': [os.path.join(local, 'Chromium', 'User Data'),
+                     os.path.join(local, 'Naver', 'Naver Whale', 'User Data')],
+    }
+    if browser == 'firefox':
+        import glob
+        return glob.glob(os.path.join(roaming, 'Mozilla', 'Firefox', 'Profiles', '*', 'cookies.sqlite'))
+    if browser == 'opera':
+        base = os.path.join(roaming, 'Opera Software', 'Opera Stable')
+        return [os.path.join(base, 'Network', 'Cookies'), os.path.join(base, 'Cookies')]
+    return [os.path.join(d, 'Default', sub)
+            for d in chromium_dirs.get(browser, [])
+            for sub in (os.path.join('Network', 'Cookies'), 'Cookies')]
+
+def _browser_cookie_db_mtime(browser):
+    """쿠키 DB(+ -wal/-journal)의 최신 mtime. 찾지 못하면 None."""
+    latest = None
+    for path in _browser_cookie_db_paths(browser):
+        for p in (path, path + '-wal', path + '-journal'):
+            try:
+                m = os.path.getmtime(p)
+            except OSError:
+                continue
+            latest = m if latest is None else max(latest, m)
+    return latest
+
+def _filter_custom_cookies(jar):
+    """CUSTOM_DOMAINS 쿠키만 담은 새 jar와 cf_clearance 최소 만료 시각을 반환합니다."""
+    from http.cookiejar import CookieJar
+    filtered = CookieJar()
+    cf_expires = None
+    for cookie in jar:
+        cd = cookie.domain.lstrip('.')
+        if any(cd == d or cd.endswith('.' + d) for d in CUSTOM_DOMAINS):
+            filtered.set_cookie(cookie)
+            if cookie.name == 'cf_clearance' and cookie.expires:
+                cf_expires = cookie.expires if cf_expires is None else min(cf_expires, cookie.expires)
+    return filtered, cf_expires
+
+def _cookie_jar_invalidate():
+    global _cookie_jar_cache
+    with _cookie_jar_lock:
+        _cookie_jar_cache = None
+
 def _build_cookie_jar_from_browser(browser: str = ''):
-    """yt-dlp를 통해 브라우저의 쿠키 jar를 안전하게 추출합니다."""
+    """브라우저 쿠키 jar (CUSTOM_DOMAINS 쿠키만)를 캐시에서 반환하고, 바뀌었을 때만 다시 추출합니다."""
+    global _cookie_jar_cache
     if not browser:
         browser = _get_browser()
     if not browser:
         return None, ''
-
+    with _cookie_jar_lock:
+        now = time.time()
+        mtime = _browser_cookie_db_mtime(browser)
+        c = _cookie_jar_cache
+        if (c and c["browser"] == browser
+                and (c["mtime"] == mtime if mtime is not None else now - c["loaded_at"] < _COOKIE_JAR_MAX_AGE)
+                and not (c["cf_expires"] and c["cf_expires"] <= now)):
+            return c["jar"], c["name"]
+        jar, name = _extract_cookie_jar_from_browser(browser)
+        cf_expires = None
+        if jar is not None:
+            jar, cf_expires = _filter_custom_cookies(jar)
+        _cookie_jar_cache = {"browser": browser, "jar": jar, "name": name, "mtime": mtime,
+                             "cf_expires": cf_expires, "loaded_at": now}
+        return jar, name
+
+def _extract_cookie_jar_from_browser(browser):
+    """yt-dlp를 통해 브라우저의 쿠키 jar를 안전하게 추출합니다. (캐시 없이, _build_cookie_jar_from_browser 전용)"""
     try:
         # yt-dlp YoutubeDL 인스턴스를 만들어 쿠키 jar만 가져오기
         # 이 방식이 내부 API보다 안정적
@@ -933,41 +1032,938 @@ def _build_cookie_jar_from_browser(browser: str = ''):
 
 
 # ──────────────────────────────────────────────
-# 데이터 저장/로드 (파일 기반, 용량 무제한)
+# 데이터 저장/로드 (메모리 모델 + SQLite write-behind)
+# 시작 시 data.db를 한 번 읽어 _store에 올리고, 모든 라우트는 _data_lock 아래에서
+# 메모리만 읽고/바꿉니다. 바뀐 행은 _dirty에 기록되어 _flusher_loop가 모아서 씁니다.
+# 재생 위치/히트맵 이벤트와 대기열 변경은 data.journal에도 한 줄씩 추가되어, 플러시 전에 죽어도 시작 시 재적용됩니다.
+# data.json은 복구용 스냅샷 (+ .bak/.bak2 순환)
 # ──────────────────────────────────────────────
-_data_lock = threading.Lock()
+_data_lock = threading.RLock()
+_flush_lock = threading.Lock()      # 플러시 직렬화 (플러셔 스레드 ↔ 종료 저장)
+_flush_wake = threading.Event()     # 더티 임계치 도달 시 즉시 플러시
+_snapshot_lock = threading.Lock()   # data.json 스냅샷 쓰기 직렬화
+_db_local = threading.local()
+
+_FLUSH_INTERVAL_SEC = 3.0   # 주기적 플러시 간격
+_FLUSH_MAX_DIRTY = 200      # 더티 변경이 이 수를 넘으면 즉시 플러시
+
+_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    id   TEXT PRIMARY KEY,
+    pos  INTEGER NOT NULL,
+    item TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_queue_pos ON queue(pos);
+CREATE TABLE IF NOT EXISTS playback (
+    item_id    TEXT PRIMARY KEY,
+    position   REAL NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS heatmap_arrays (
+    item_id TEXT PRIMARY KEY,
+    counts  BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS categories (
+    id    TEXT PRIMARY KEY,
+    pos   INTEGER NOT NULL,
+    name  TEXT NOT NULL,
+    color TEXT
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS extract_cache (
+    id         TEXT PRIMARY KEY,
+    url        TEXT NOT NULL,
+    info       TEXT,
+    expires_at REAL,
+    related    TEXT,
+    related_at REAL
+);
+"""
 
-def _load_data():
-    """data.json을 로드합니다. 손상 시 백업에서 복구를 시도합니다."""
+# 권위 있는 메모리 모델 (반드시 _data_lock 아래에서 접근)
+_store = {"queue": [], "playback": {}, "heatmaps": {}, "categories": [], "settings": {}}
+_queue_index = {}  # id -> _store["queue"]의 항목 (같은 객체)
+
+def _new_dirty():
+    return {
+        "full": False,          # 전체 재기록 (clear/가져오기/플러시 실패 후)
+        "queue": set(),         # 추가/수정된 항목 id
+        "queue_order": False,   # pos 전체 재기록
+        "removed": set(),       # 삭제된 항목 id (queue/playback/heatmaps 행 삭제)
+        "playback": set(),
+        "heatmaps": set(),      # 배열 전체를 다시 쓸 item_id
+        "categories": False,
+        "settings": False,
+        "meta": {},             # meta 키 -> 플러시 때 값을 만드는 함수
+        "count": 0,
+    }
+
+_dirty = _new_dirty()
+
+# 저널: {"q": 순번, "t": 종류, ...} JSONL
+#   "h"/"hb"(히트맵), "p"(재생위치),
+#   "qa"(대기열 추가), "qu"(필드 갱신), "qr"(삭제), "qo"(순서), "qc"(비우기)
+# 플러시가 meta.journal_seq를 같은 트랜잭션에 기록하므로, 재생(replay)은 그 이후 순번만 적용합니다.
+_journal_fp = None
+_journal_seq = 0
+_journal_replaying = False   # 재생 중에는 대기열 헬퍼가 다시 저널에 쓰지 않도록
+
+# 대기열 리비전: 대기열이 바뀔 때마다 1 증가 (meta.queue_rev에 보존).
+# _queue_log의 (rev, 종류, ids)로 GET /api/queue?since=rev 델타를 만듭니다.
+# 종류: "a"(추가) / "u"(수정) / "r"(삭제) / "o"(순서 변경)
+_QUEUE_LOG_MAX = 2000
+_queue_rev = 0
+_queue_log_floor = 0   # 이보다 오래된 since는 로그로 복원 불가 → 전체 재전송
+_queue_log = deque()
+_queue_changed = threading.Condition()
+
+def _mark_dirty(n=1):
+    """더티 카운트를 올리고 임계치를 넘으면 플러셔를 깨웁니다. (_data_lock 보유 상태)"""
+    _dirty["count"] += n
+    if _dirty["count"] >= _FLUSH_MAX_DIRTY:
+        _flush_wake.set()
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False)
+
+# ── 이벤트 저널 ──
+
+def _journal_append(rec):
+    """이벤트 한 줄을 저널에 추가합니다. (_data_lock 보유 상태)"""
+    global _journal_fp, _journal_seq
+    if _journal_replaying:
+        return
+    _journal_seq += 1
+    rec["q"] = _journal_seq
+    try:
+        if _journal_fp is None:
+            _journal_fp = open(JOURNAL_FILE, "a", encoding="utf-8")
+        _journal_fp.write(json.dumps(rec, separators=(",", ":")) + "\n")
+        _journal_fp.flush()
+    except Exception as e:
+        print(f"  [저널] 기록 실패 (무시): {e}")
+
+def _read_journal():
+    """저널 레코드를 순서대로 읽습니다. 크래시로 잘린 마지막 줄은 건너뜁니다."""
+    records = []
+    if not JOURNAL_FILE.exists():
+        return records
+    with open(JOURNAL_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(rec, dict) and isinstance(rec.get("q"), int):
+                records.append(rec)
+    return records
+
+def _journal_compact(upto_seq):
+    """data.db에 반영된 순번(upto_seq)까지의 저널 레코드를 잘라냅니다."""
+    global _journal_fp
+    with _data_lock:
+        try:
+            if _journal_fp is not None:
+                _journal_fp.close()
+                _journal_fp = None
+            if _journal_seq <= upto_seq:
+                # 플러시 이후 새 이벤트 없음 → 통째로 비움
+                open(JOURNAL_FILE, "w").close()
+                return
+            keep = [r for r in _read_journal() if r["q"] > upto_seq]
+            tmp = Path(str(JOURNAL_FILE) + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for r in keep:
+                    f.write(json.dumps(r, separators=(",", ":")) + "\n")
+            tmp.replace(JOURNAL_FILE)
+        except Exception as e:
+            print(f"  [저널] 정리 실패 (무시): {e}")
+
+def _replay_journal():
+    """data.db에 아직 반영되지 않은 저널 꼬리(meta.journal_seq 이후)를 메모리 모델에 재적용합니다."""
+    global _journal_seq, _journal_replaying
+    row = _db().execute("SELECT value FROM meta WHERE key = 'journal_seq'").fetchone()
+    committed = int(row["value"]) if row else 0
+    records = _read_journal()
+    applied = 0
+    with _data_lock:
+        _journal_seq = max([committed] + [r["q"] for r in records])
+        _journal_replaying = True
+        try:
+            for rec in records:
+                if rec["q"] > committed and _replay_record(rec):
+                    applied += 1
+        finally:
+            _journal_replaying = False
+    if applied:
+        print(f"  [저널] 미반영 이벤트 {applied}건 재적용")
+
+def _replay_record(rec):
+    """저널 레코드 하나를 메모리 모델에 적용합니다. 모르는 종류면 False. (_data_lock 보유 상태)"""
+    kind = rec.get("t")
+    item_id = rec.get("id")
+    if kind == "qa":
+        _queue_add(rec["item"])
+    elif kind == "qu":
+        _queue_update_many(rec["u"])
+    elif kind == "qr":
+        _queue_remove(rec["ids"])
+    elif kind == "qo":
+        _queue_reorder(rec["ids"])
+    elif kind == "qc":
+        _queue_clear()
+    else:
+        if kind == "h":
+            _hm_incr(_store["heatmaps"].setdefault(item_id, array("I")),
+                     int(rec.get("s", 0)), int(rec.get("n", 1)))
+            _dirty["heatmaps"].add(item_id)
+        elif kind == "hb":
+            arr = _store["heatmaps"].setdefault(item_id, array("I"))
+            for sec in rec.get("s", []):
+                _hm_incr(arr, int(sec))
+            _dirty["heatmaps"].add(item_id)
+        elif kind == "p":
+            _store["playback"][item_id] = {"position": rec.get("p", 0), "updated_at": rec.get("u")}
+            _dirty["playback"].add(item_id)
+        else:
+            return False
+        _mark_dirty()
+    return True
+
+def _db():
+    """현재 스레드 전용 SQLite 연결을 반환합니다. (Flask threaded 모드 대응)"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(str(DB_FILE), timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _db_local.conn = conn
+    return conn
+
+def _db_close():
+    """현재 스레드의 SQLite 연결을 닫습니다. (다음 _db() 호출 때 다시 엶)"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None:
+        _db_local.conn = None
+        conn.close()
+
+@app.teardown_appcontext
+def _close_request_db(exc):
+    """요청이 끝나면 요청 스레드의 연결을 닫습니다. werkzeug threaded 모드는 연결마다 새 스레드를 쓰므로
+    열어 둔 채로 두면 긴 세션 동안 연결이 쌓입니다. (백그라운드 워커/플러셔 스레드는 계속 재사용)"""
+    _db_close()
+
+def _read_json_data():
+    """data.json을 로드합니다. 손상 시 백업에서 복구를 시도합니다. (마이그레이션/복구용)"""
     for fp in [DATA_FILE, Path(str(DATA_FILE) + ".bak"), Path(str(DATA_FILE) + ".bak2")]:
         if not fp.exists():
             continue
         try:
             with open(fp, "r", encoding="utf-8") as f:
                 data = json.load(f)
-            if "categories" not in data:
-                data["categories"] = []
             if fp != DATA_FILE:
                 print(f"  [복구] {fp.name}에서 데이터 복구 성공")
-                # 복구된 데이터를 원본에 저장
-                try:
-                    with open(DATA_FILE, "w", encoding="utf-8") as f2:
-                        json.dump(data, f2, ensure_ascii=False, indent=2)
-                except Exception:
-                    pass
             return data
         except (json.JSONDecodeError, ValueError) as e:
             print(f"  [경고] {fp.name} 손상됨: {e}")
             continue
         except Exception:
             continue
-    return {"queue": [], "playback": {}, "heatmaps": {}, "categories": []}
+    return None
+
+def _load_store_from_db():
+    """data.db 전체를 메모리 모델로 읽어옵니다. (시작 시 1회)"""
+    conn = _db()
+    queue = [json.loads(r["item"]) for r in conn.execute("SELECT item FROM queue ORDER BY pos")]
+    playback = {r["item_id"]: {"position": r["position"], "updated_at": r["updated_at"]}
+                for r in conn.execute("SELECT item_id, position, updated_at FROM playback")}
+    heatmaps = {r["item_id"]: _hm_from_bytes(r["counts"])
+                for r in conn.execute("SELECT item_id, counts FROM heatmap_arrays")}
+    categories = [{"id": r["id"], "name": r["name"], "color": r["color"]}
+                  for r in conn.execute("SELECT id, name, color FROM categories ORDER BY pos")]
+    settings = {r["key"]: json.loads(r["value"])
+                for r in conn.execute("SELECT key, value FROM settings")}
+    row = conn.execute("SELECT value FROM meta WHERE key = 'queue_rev'").fetchone()
+    with _data_lock:
+        _store.update(queue=queue, playback=playback, heatmaps=heatmaps,
+                      categories=categories, settings=settings)
+        _queue_index.clear()
+        _queue_index.update({item["id"]: item for item in queue})
+        # 재시작 전 리비전을 가진 클라이언트는 전체를 다시 받도록 새 기준점에서 시작
+        _queue_bump("reset", base=int(row["value"]) if row else 0)
+
+def _init_db():
+    """스키마를 생성하고, 최초 1회 data.json(.bak/.bak2)에서 마이그레이션한 뒤
+    메모리 모델을 로드합니다. DB 파일이 손상되었으면 .corrupt로 옮기고 스냅샷에서 다시 만듭니다."""
+    try:
+        conn = _db()
+        conn.executescript(_DB_SCHEMA)
+        conn.execute("PRAGMA quick_check").fetchone()
+    except sqlite3.DatabaseError as e:
+        print(f"  [DB] {DB_FILE.name} 손상됨: {e} → JSON 스냅샷에서 재구성")
+        _db_close()
+        for suffix in ("", "-wal", "-shm"):
+            fp = Path(str(DB_FILE) + suffix)
+            if fp.exists():
+                fp.replace(Path(str(DB_FILE) + suffix + ".corrupt"))
+        conn = _db()
+        conn.executescript(_DB_SCHEMA)
+
+    # 구버전 초 단위 행(heatmaps) → 항목별 배열(heatmap_arrays) 변환
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'heatmaps'").fetchone():
+        converted = {}
+        for r in conn.execute("SELECT item_id, second, count FROM heatmaps"):
+            _hm_incr(converted.setdefault(r["item_id"], array("I")), r["second"], r["count"])
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO heatmap_arrays (item_id, counts) VALUES (?, ?)",
+                             [(k, _hm_to_bytes(v)) for k, v in converted.items()])
+            conn.execute("DROP TABLE heatmaps")
+        print(f"  [DB] 히트맵 {len(converted)}개 항목을 배열 형식으로 변환")
+
+    row = conn.execute("SELECT value FROM meta WHERE key = 'migrated_at'").fetchone()
+    if not row:
+        legacy = _read_json_data()
+        if legacy:
+            _save_data(legacy)
+            _flush_dirty()
+            print(f"  [DB] data.json → {DB_FILE.name} 마이그레이션 완료 "
+                  f"(대기열 {len(legacy.get('queue', []))}개)")
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_at', ?)",
+                         (str(time.time()),))
+    _load_store_from_db()
+    _replay_journal()
+    _flush_dirty()
+
+# ── 대기열 ──
+
+def _queue_bump(kind, ids=(), base=None):
+    """대기열 리비전을 올리고 변경 로그에 기록합니다. (_data_lock 보유 상태)
+    "reset"은 로그를 비우고 기준점(floor)을 현재 리비전으로 옮깁니다."""
+    global _queue_rev, _queue_log_floor
+    _queue_rev = max(_queue_rev, base or 0) + 1
+    if kind == "reset":
+        _queue_log.clear()
+        _queue_log_floor = _queue_rev
+    else:
+        if len(_queue_log) >= _QUEUE_LOG_MAX:
+            _queue_log_floor = _queue_log.popleft()[0]
+        _queue_log.append((_queue_rev, kind, tuple(ids)))
+    with _queue_changed:
+        _queue_changed.notify_all()
+
+def _queue_delta(since, fields=None):
+    """since 리비전 이후의 변경분 {rev, items, removed[, order]}. 로그로 만들 수 없으면 None."""
+    with _data_lock:
+        if since > _queue_rev or since < _queue_log_floor:
+            return None
+        upserts = {}   # 삽입 순서 유지 (새 항목은 이 순서로 끝에 붙음)
+        removed = set()
+        order = False
+        for rev, kind, ids in _queue_log:
+            if rev <= since:
+                continue
+            if kind == "o":
+                order = True
+                continue
+            for uid in ids:
+                if kind == "r":
+                    upserts.pop(uid, None)
+                    removed.add(uid)
+                else:
+                    if kind == "a" and uid in removed:
+                        order = True   # 삭제 후 재추가 → 위치가 바뀜
+                    removed.discard(uid)
+                    upserts[uid] = True
+        delta = {
+            "rev": _queue_rev,
+            "items": [_project(_queue_index[uid], fields) for uid in upserts if uid in _queue_index],
+            "removed": [uid for uid in removed if uid not in _queue_index],
+        }
+        if order:
+            delta["order"] = [item["id"] for item in _store["queue"]]
+        return delta
+
+def _project(item, fields):
+    return {k: item[k] for k in fields if k in item} if fields else dict(item)
+
+def _queue_page(fields=None, category=None, q=None, cursor=None, limit=None):
+    """필터/필드 선택/커서 페이지네이션을 적용한 대기열 조회.
+    category: 카테고리 id 또는 "__none__"(미분류), q: 제목 부분 문자열(대소문자 무시),
+    cursor: 이전 페이지의 next_cursor ("위치:id"). (items, next_cursor, total) 반환"""
+    q = q.lower() if q else None
+    with _data_lock:
+        rows = _store["queue"]
+        if category:
+            rows = [item for item in rows
+                    if (not item.get("category") if category == "__none__" else item.get("category") == category)]
+        if q:
+            rows = [item for item in rows if q in (item.get("title") or "").lower()]
+        start = 0
+        if cursor:
+            pos, _, last_id = cursor.partition(":")
+            ids = [item["id"] for item in rows]
+            # 커서 항목이 그대로 있으면 그 다음부터, 삭제됐으면 그 자리(한 칸 당겨진 위치)부터
+            start = ids.index(last_id) + 1 if last_id in ids else max(0, int(pos or 0) - 1)
+        end = len(rows) if not limit else min(start + limit, len(rows))
+        page = [_project(item, fields) for item in rows[start:end]]
+        next_cursor = f"{end}:{rows[end - 1]['id']}" if end < len(rows) else None
+        return page, next_cursor, len(rows)
+
+def _queue_items():
+    """대기열 전체를 순서대로 반환합니다. (얕은 복사본)"""
+    with _data_lock:
+        return [dict(item) for item in _store["queue"]]
+
+def _queue_find(uid):
+    with _data_lock:
+        item = _queue_index.get(uid)
+        return dict(item) if item else None
+
+def _queue_ids():
+    with _data_lock:
+        return [item["id"] for item in _store["queue"]]
+
+def _queue_add(entry):
+    """대기열 맨 끝에 항목을 추가합니다. 이미 있으면 False."""
+    with _data_lock:
+        if entry["id"] in _queue_index:
+            return False
+        item = dict(entry)
+        _store["queue"].append(item)
+        _queue_index[item["id"]] = item
+        _dirty["queue"].add(item["id"])
+        _mark_dirty()
+        _journal_append({"t": "qa", "item": item})
+        _queue_bump("a", (item["id"],))
+        return True
+
+def _queue_update(uid, **fields):
+    """항목의 필드를 갱신합니다. 값이 None이면 필드를 제거합니다."""
+    with _data_lock:
+        item = _queue_index.get(uid)
+        if item is None:
+            return None
+        for k, v in fields.items():
+            if v is None:
+                item.pop(k, None)
+            else:
+                item[k] = v
+        _dirty["queue"].add(uid)
+        _mark_dirty()
+        _journal_append({"t": "qu", "u": {uid: fields}})
+        _queue_bump("u", (uid,))
+        return dict(item)
+
+def _queue_update_many(updates):
+    """{item_id: {필드: 값}}을 한 번에 반영합니다. (리비전 1회 증가) 반영된 id 목록 반환."""
+    changed = []
+    with _data_lock:
+        for uid, fields in updates.items():
+            item = _queue_index.get(uid)
+            if item is None:
+                continue
+            for k, v in fields.items():
+                if v is None:
+                    item.pop(k, None)
+                else:
+                    item[k] = v
+            _dirty["queue"].add(uid)
+            changed.append(uid)
+        if changed:
+            _mark_dirty(len(changed))
+            _journal_append({"t": "qu", "u": {uid: updates[uid] for uid in changed}})
+            _queue_bump("u", changed)
+    return changed
+
+def _queue_after(uid, count):
+    """uid 다음에 오는 항목 최대 count개 (얕은 복사본). uid가 없으면 빈 목록."""
+    with _data_lock:
+        item = _queue_index.get(uid)
+        if item is None:
+            return []
+        idx = _store["queue"].index(item)
+        return [dict(it) for it in _store["queue"][idx + 1:idx + 1 + count]]
+
+def _queue_remove(ids):
+    """항목과 관련 재생 위치/히트맵을 함께 삭제합니다."""
+    id_set = set(ids)
+    with _data_lock:
+        _store["queue"] = [item for item in _store["queue"] if item["id"] not in id_set]
+        for uid in id_set:
+            _queue_index.pop(uid, None)
+            _store["playback"].pop(uid, None)
+            _store["heatmaps"].pop(uid, None)
+            _dirty["queue"].discard(uid)
+            _dirty["playback"].discard(uid)
+            _dirty["heatmaps"].discard(uid)
+        _dirty["removed"] |= id_set
+        _dirty["queue_order"] = True
+        _mark_dirty(len(id_set))
+        _journal_append({"t": "qr", "ids": list(id_set)})
+        _queue_bump("r", id_set)
+
+def _queue_clear():
+    with _data_lock:
+        _store["queue"] = []
+        _store["playback"] = {}
+        _store["heatmaps"] = {}
+        _queue_index.clear()
+        _dirty["full"] = True
+        _mark_dirty()
+        _journal_append({"t": "qc"})
+        _queue_bump("reset")
+
+def _queue_reorder(id_order):
+    """id_order 순서대로 재배치합니다. 목록에 없는 기존 항목은 뒤에 유지됩니다."""
+    with _data_lock:
+        seen = set()
+        ordered = []
+        for uid in id_order:
+            if uid in _queue_index and uid not in seen:
+                ordered.append(_queue_index[uid])
+                seen.add(uid)
+        ordered += [item for item in _store["queue"] if item["id"] not in seen]
+        _store["queue"] = ordered
+        _dirty["queue_order"] = True
+        _mark_dirty()
+        _journal_append({"t": "qo", "ids": [item["id"] for item in ordered]})
+        _queue_bump("o")
+
+def _queue_move(item_ids, position="top"):
+    """항목들을 맨 위 또는 맨 아래로 이동합니다. (상대 순서 유지)"""
+    id_set = set(item_ids)
+    with _data_lock:
+        current = [item["id"] for item in _store["queue"]]
+        moved = [uid for uid in current if uid in id_set]
+        rest = [uid for uid in current if uid not in id_set]
+        _queue_reorder(moved + rest if position == "top" else rest + moved)
+
+def _queue_set_category(item_ids, category):
+    """여러 항목의 카테고리를 변경합니다. category가 비어있으면 미분류. 변경된 수 반환."""
+    changed = 0
+    with _data_lock:
+        for uid in item_ids:
+            if _queue_update(uid, category=category or None) is not None:
+                changed += 1
+    return changed
+
+# ── 재생 위치 ──
+
+def _playback_get(item_id):
+    with _data_lock:
+        pb = _store["playback"].get(item_id)
+        return dict(pb) if pb else None
+
+def _playback_positions(ids=None):
+    """{item_id: 위치(초)} — 위치가 0보다 큰 항목만. ids가 없으면 전체."""
+    with _data_lock:
+        pbs = _store["playback"]
+        keys = pbs.keys() if ids is None else (k for k in ids if k in pbs)
+        return {k: pbs[k].get("position", 0) for k in keys if pbs[k].get("position", 0) > 0}
+
+def _playback_recent(limit, within_sec):
+    """within_sec 안에 재생 위치가 저장된 항목 id를 최근 순으로 최대 limit개."""
+    cutoff = time.time() - within_sec
+    with _data_lock:
+        recent = [(pb.get("updated_at") or 0, k) for k, pb in _store["playback"].items()
+                  if (pb.get("updated_at") or 0) >= cutoff]
+    return [k for _, k in heapq.nlargest(limit, recent)]
+
+def _playback_set(item_id, position, updated_at=None):
+    with _data_lock:
+        pb = {"position": position, "updated_at": updated_at or time.time()}
+        _store["playback"][item_id] = pb
+        _journal_append({"t": "p", "id": item_id, "p": pb["position"], "u": pb["updated_at"]})
+        _dirty["playback"].add(item_id)
+        _mark_dirty()
+
+# ── 히트맵 ──
+
+# 항목별 array('I') — 인덱스 = 초, 값 = 시청 횟수. DB에는 리틀 엔디언 BLOB,
+# JSON 스냅샷/내보내기에는 base64 문자열로 저장합니다. (구버전 {"초": 횟수} dict도 읽음)
+
+_HEATMAP_MAX_SEC = 24 * 3600  # 비정상적인 second 값으로 배열이 커지지 않도록 제한
+
+def _hm_from_bytes(blob):
+    arr = array("I")
+    arr.frombytes(blob[:len(blob) - len(blob) % arr.itemsize])
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+def _hm_to_bytes(arr):
+    if sys.byteorder != "little":
+        arr = array("I", arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+def _hm_incr(arr, second, count=1):
+    """배열의 second 칸에 count를 더합니다. 필요하면 배열을 늘립니다."""
+    if not 0 <= second < _HEATMAP_MAX_SEC:
+        return
+    if second >= len(arr):
+        arr.extend(bytes(second + 1 - len(arr)))
+    arr[second] += count
+
+def _hm_coerce(value):
+    """base64 문자열 / 리스트 / 레거시 dict 히트맵을 array('I')로 변환합니다."""
+    if isinstance(value, str):
+        return _hm_from_bytes(base64.b64decode(value))
+    if isinstance(value, (list, array)):
+        return array("I", (max(0, int(c)) for c in value[:_HEATMAP_MAX_SEC]))
+    arr = array("I")
+    if isinstance(value, dict):
+        for sec, cnt in value.items():
+            _hm_incr(arr, int(sec), max(0, int(cnt)))
+    return arr
+
+def _hm_merge(dst, src):
+    """src를 dst에 원소별로 더합니다. (dst 제자리 변경)"""
+    if len(dst) < len(src):
+        dst.extend(bytes(len(src) - len(dst)))
+    n = len(src)
+    dst[:n] = array("I", map(operator.add, dst[:n], src))
+
+def _hm_buckets(arr, buckets, span=None):
+    """히트맵을 buckets개 구간으로 다운샘플링합니다. 각 구간 값은 그 안에서 가장 많이 본 초의 시청 횟수
+    (초 단위 히트맵과 같은 단위 → 구간이 여러 초를 덮어도 프론트엔드의 "2회 이상" 기준이 그대로 맞음).
+    span(초)이 없으면 기록된 마지막 초까지를 대상으로 합니다. (값 목록, 구간 길이) 반환"""
+    span = int(span) if span else len(arr)
+    if buckets <= 0 or span <= 0:
+        return [], 0
+    width = max(1.0, span / buckets)
+    out = [0] * int(-(-span // width))   # ceil(span / width)
+    last = len(out) - 1
+    for sec in range(min(span, len(arr))):
+        cnt = arr[sec]
+        if cnt:
+            idx = min(int(sec / width), last)
+            if cnt > out[idx]:
+                out[idx] = cnt
+    return out, width
+
+def _heatmap_get(item_id):
+    """레거시 형식 {"초": 횟수} (0이 아닌 칸만)"""
+    with _data_lock:
+        arr = _store["heatmaps"].get(item_id)
+        return {str(sec): cnt for sec, cnt in enumerate(arr) if cnt} if arr else {}
+
+def _heatmap_buckets(item_id, buckets, span=None):
+    with _data_lock:
+        arr = _store["heatmaps"].get(item_id)
+        return _hm_buckets(arr if arr else array("I"), buckets, span)
+
+def _heatmap_add(item_id, second, count=1):
+    second = int(second)
+    with _data_lock:
+        _hm_incr(_store["heatmaps"].setdefault(item_id, array("I")), second, count)
+        _journal_append({"t": "h", "id": item_id, "s": second, "n": count})
+        _dirty["heatmaps"].add(item_id)
+        _mark_dirty()
+
+def _heatmap_add_batch(item_id, seconds):
+    """여러 틱을 한 번의 변경(저널 1줄, 더티 1건)으로 기록합니다."""
+    seconds = [sec for sec in seconds if 0 <= sec < _HEATMAP_MAX_SEC]
+    if not seconds:
+        return 0
+    with _data_lock:
+        arr = _store["heatmaps"].setdefault(item_id, array("I"))
+        for sec in seconds:
+            _hm_incr(arr, sec)
+        _journal_append({"t": "hb", "id": item_id, "s": seconds})
+        _dirty["heatmaps"].add(item_id)
+        _mark_dirty()
+    return len(seconds)
+
+def _heatmap_merge(item_id, hm):
+    """가져온 히트맵을 기존 배열에 원소별로 더합니다."""
+    src = _hm_coerce(hm)
+    with _data_lock:
+        _hm_merge(_store["heatmaps"].setdefault(item_id, array("I")), src)
+        _dirty["heatmaps"].add(item_id)
+        _mark_dirty()
+
+# ── 카테고리 ──
+
+def _categories_list():
+    with _data_lock:
+        return [dict(c) for c in _store["categories"]]
+
+def _category_add(cat):
+    with _data_lock:
+        _store["categories"].append(dict(cat))
+        _dirty["categories"] = True
+        _mark_dirty()
+
+def _category_update(cat_id, **fields):
+    with _data_lock:
+        for cat in _store["categories"]:
+            if cat["id"] == cat_id:
+                for k in ("name", "color"):
+                    if k in fields:
+                        cat[k] = fields[k]
+                _dirty["categories"] = True
+                _mark_dirty()
+                return dict(cat)
+    return None
+
+def _category_delete(cat_id):
+    """카테고리를 삭제하고 소속 항목은 미분류로 돌립니다."""
+    with _data_lock:
+        _store["categories"] = [c for c in _store["categories"] if c["id"] != cat_id]
+        _dirty["categories"] = True
+        _mark_dirty()
+        ids = [item["id"] for item in _store["queue"] if item.get("category") == cat_id]
+        _queue_set_category(ids, None)
+
+def _categories_reorder(id_order):
+    with _data_lock:
+        id_map = {c["id"]: c for c in _store["categories"]}
+        ordered = [id_map[cid] for cid in id_order if cid in id_map]
+        ordered += [c for c in _store["categories"] if c["id"] not in id_order]
+        _store["categories"] = ordered
+        _dirty["categories"] = True
+        _mark_dirty()
+
+# ── 설정 ──
+
+def _settings_get():
+    with _data_lock:
+        return dict(_store["settings"])
+
+def _settings_put(settings):
+    with _data_lock:
+        _store["settings"].update(settings)
+        _dirty["settings"] = True
+        _mark_dirty()
+
+# ── 내부 메타 값 (드물게 쓰는 서버 상태, 바로 기록) ──
+# 자주 바뀌는 값은 _meta_mark로 더티 표시만 하고 다음 플러시에 함께 기록합니다.
+
+def _meta_get(key, default=None):
+    row = _db().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row["value"]) if row and row["value"] else default
+
+def _meta_put(key, value):
+    try:
+        with _db() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, _dumps(value)))
+    except sqlite3.Error as e:
+        print(f"  [DB] meta 기록 실패 ({key}): {e}")
+
+def _meta_mark(key, snapshot):
+    """meta[key]를 다음 플러시에 기록하도록 표시합니다. snapshot()은 플러시 때 호출되어 값을 반환합니다."""
+    with _data_lock:
+        if key not in _dirty["meta"]:
+            _dirty["meta"][key] = snapshot
+            _mark_dirty()
+
+# ── 추출 캐시 (디스크, 재시작 후에도 유지) ──
+# _url_id(url) 키로 추출 요약과 관련 영상 목록을 저장합니다. 필요할 때 한 행씩만 읽습니다.
+
+_EXTRACT_DISK_KEYS = ("title", "duration", "thumbnail", "url", "http_headers", "_variants", "ext", "protocol")
+_EXTRACT_DISK_MIN_LEFT = 120     # 만료까지 이보다 적게 남은 항목은 쓰지 않음(초)
+_RELATED_DISK_TTL = 43200        # 관련 영상 목록 유지 시간 (12시간)
+
+def _extract_disk_get(url):
+    """디스크 캐시의 추출 요약을 반환합니다. 없거나 곧 만료되면 None."""
+    try:
+        row = _db().execute("SELECT info, expires_at FROM extract_cache WHERE id = ?",
+                            (_url_id(url),)).fetchone()
+    except sqlite3.Error:
+        return None
+    if not row or not row["info"] or (row["expires_at"] or 0) - time.time() < _EXTRACT_DISK_MIN_LEFT:
+        return None
+    return json.loads(row["info"])
+
+def _extract_disk_put(url, info):
+    """추출 결과 요약을 stream_url 만료 시각(모르면 _CACHE_TTL 뒤)까지 저장합니다."""
+    now = time.time()
+    summary = {k: info[k] for k in _EXTRACT_DISK_KEYS if info.get(k)}
+    expires_at = _stream_expiry(summary.get("url"), now) or now + _CACHE_TTL
+    try:
+        with _db() as conn:
+            conn.execute(
+                "INSERT INTO extract_cache (id, url, info, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET url = excluded.url, info = excluded.info, "
+                "expires_at = excluded.expires_at",
+                (_url_id(url), url, _dumps(summary), expires_at))
+    except sqlite3.Error as e:
+        print(f"  [DB] 추출 캐시 기록 실패: {e}")
+    return summary
+
+def _related_disk_get(url):
+    try:
+        row = _db().execute("SELECT related, related_at FROM extract_cache WHERE id = ?",
+                            (_url_id(url),)).fetchone()
+    except sqlite3.Error:
+        return None
+    if not row or row["related"] is None or time.time() - (row["related_at"] or 0) > _RELATED_DISK_TTL:
+        return None
+    return json.loads(row["related"])
+
+def _related_disk_put(url, related):
+    try:
+        with _db() as conn:
+            conn.execute(
+                "INSERT INTO extract_cache (id, url, related, related_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET related = excluded.related, related_at = excluded.related_at",
+                (_url_id(url), url, _dumps(related), time.time()))
+    except sqlite3.Error as e:
+        print(f"  [DB] 관련 영상 캐시 기록 실패: {e}")
+
+def _extract_disk_prune():
+    """추출 요약과 관련 목록이 모두 만료된 행을 지웁니다."""
+    now = time.time()
+    try:
+        with _db() as conn:
+            cur = conn.execute(
+                "DELETE FROM extract_cache WHERE COALESCE(expires_at, 0) < ? AND COALESCE(related_at, 0) < ?",
+                (now, now - _RELATED_DISK_TTL))
+        return cur.rowcount
+    except sqlite3.Error as e:
+        print(f"  [DB] 추출 캐시 정리 실패: {e}")
+        return 0
+
+# ── 전체 스냅샷 (내보내기/백업용) ──
+
+def _load_data():
+    """메모리 모델 전체를 기존 data.json 형식의 dict로 복사해 반환합니다."""
+    with _data_lock:
+        return {
+            "queue": [dict(item) for item in _store["queue"]],
+            "playback": {k: dict(v) for k, v in _store["playback"].items()},
+            "heatmaps": {k: base64.b64encode(_hm_to_bytes(v)).decode("ascii")
+                         for k, v in _store["heatmaps"].items()},
+            "categories": [dict(c) for c in _store["categories"]],
+            "settings": dict(_store["settings"]),
+        }
 
 def _save_data(data):
-    """data.json을 저장합니다. 저장 전 이중 백업을 수행합니다.
+    """data.json 형식의 dict로 메모리 모델 전체를 교체합니다. (다음 플러시에서 전체 재기록)"""
+    with _data_lock:
+        queue = []
+        seen = set()
+        for item in data.get("queue", []):
+            if item.get("id") and item["id"] not in seen:
+                queue.append(dict(item))
+                seen.add(item["id"])
+        _store["queue"] = queue
+        _queue_index.clear()
+        _queue_index.update({item["id"]: item for item in queue})
+        _store["playback"] = {k: dict(v) for k, v in data.get("playback", {}).items()
+                              if isinstance(v, dict)}
+        _store["heatmaps"] = {k: _hm_coerce(v) for k, v in data.get("heatmaps", {}).items()}
+        _store["categories"] = [dict(c) for c in data.get("categories", [])]
+        _store["settings"] = dict(data.get("settings", {}))
+        _dirty["full"] = True
+        _mark_dirty()
+        _queue_bump("reset")
+    _flush_wake.set()   # 전체 교체는 저널에 남지 않으므로 바로 플러시
+
+# ── write-behind 플러시 ──
+
+def _flush_dirty():
+    """더티 상태를 한 트랜잭션으로 data.db에 기록합니다. 기록한 변경 수를 반환합니다.
+    쓰기 실패 시 다음 플러시에서 전체를 다시 기록하도록 표시합니다."""
+    global _dirty
+    with _flush_lock:
+        with _data_lock:
+            d = _dirty
+            if d["count"] == 0:
+                return 0
+            _dirty = _new_dirty()
+            _flush_wake.clear()
+            upto_seq = _journal_seq
+            upto_rev = _queue_rev
+            # 잠금 안에서 기록할 행을 직렬화 (이후 변경과 섞이지 않도록)
+            if d["full"]:
+                snap = _load_data()
+                queue_rows = [(item["id"], i, _dumps(item)) for i, item in enumerate(snap["queue"])]
+                playback_rows = [(k, v.get("position", 0), v.get("updated_at"))
+                                 for k, v in snap["playback"].items()]
+                heat_rows = [(item_id, _hm_to_bytes(arr)) for item_id, arr in _store["heatmaps"].items()]
+            else:
+                pos = {item["id"]: i for i, item in enumerate(_store["queue"])}
+                queue_rows = [(uid, pos[uid], _dumps(_queue_index[uid]))
+                              for uid in d["queue"] if uid in _queue_index]
+                order_rows = ([(i, item["id"]) for i, item in enumerate(_store["queue"])]
+                              if d["queue_order"] else [])
+                playback_rows = [(k, _store["playback"][k]["position"],
+                                  _store["playback"][k].get("updated_at"))
+                                 for k in d["playback"] if k in _store["playback"]]
+                heat_rows = [(item_id, _hm_to_bytes(_store["heatmaps"][item_id]))
+                             for item_id in d["heatmaps"] if item_id in _store["heatmaps"]]
+            cat_rows = ([(c["id"], i, c.get("name", ""), c.get("color"))
+                         for i, c in enumerate(_store["categories"])]
+                        if d["full"] or d["categories"] else None)
+            setting_rows = ([(k, _dumps(v)) for k, v in _store["settings"].items()]
+                            if d["full"] or d["settings"] else None)
+            meta_rows = [(k, _dumps(snapshot())) for k, snapshot in d["meta"].items()]
+
+        try:
+            with _db() as conn:
+                if d["full"]:
+                    for table in ("queue", "playback", "heatmap_arrays"):
+                        conn.execute(f"DELETE FROM {table}")
+                else:
+                    removed = [(uid,) for uid in d["removed"]]
+                    conn.executemany("DELETE FROM queue WHERE id = ?", removed)
+                    conn.executemany("DELETE FROM playback WHERE item_id = ?", removed)
+                    conn.executemany("DELETE FROM heatmap_arrays WHERE item_id = ?", removed)
+                    conn.executemany("UPDATE queue SET pos = ? WHERE id = ?", order_rows)
+                conn.executemany("INSERT OR REPLACE INTO queue (id, pos, item) VALUES (?, ?, ?)",
+                                 queue_rows)
+                conn.executemany("INSERT OR REPLACE INTO playback (item_id, position, updated_at) "
+                                 "VALUES (?, ?, ?)", playback_rows)
+                conn.executemany("INSERT OR REPLACE INTO heatmap_arrays (item_id, counts) "
+                                 "VALUES (?, ?)", heat_rows)
+                if cat_rows is not None:
+                    conn.execute("DELETE FROM categories")
+                    conn.executemany("INSERT OR IGNORE INTO categories (id, pos, name, color) "
+                                     "VALUES (?, ?, ?, ?)", cat_rows)
+                if setting_rows is not None:
+                    conn.execute("DELETE FROM settings")
+                    conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?)", setting_rows)
+                conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                 [("journal_seq", str(upto_seq)), ("queue_rev", str(upto_rev))] + meta_rows)
+        except Exception as e:
+            print(f"  [DB] 플러시 실패 (다음 주기에 전체 재기록): {e}")
+            with _data_lock:
+                _dirty["full"] = True
+                for k, snapshot in d["meta"].items():
+                    _dirty["meta"].setdefault(k, snapshot)
+                _mark_dirty(d["count"])
+            return 0
+        # 반영된 저널 구간 정리 (컴팩션)
+        _journal_compact(upto_seq)
+        return d["count"]
+
+def _flusher_loop():
+    """_FLUSH_INTERVAL_SEC 주기 또는 더티 임계치 도달 시 메모리 변경을 data.db에 기록합니다."""
+    while True:
+        _flush_wake.wait(_FLUSH_INTERVAL_SEC)
+        try:
+            _flush_dirty()
+        except Exception as e:
+            print(f"  [DB] 플러셔 오류: {e}")
+
+def _write_json_snapshot():
+    """메모리 모델을 data.json 스냅샷으로 씁니다. 쓰기 전 이중 백업을 수행합니다.
     백업 순환: data.json.bak → data.json.bak2, data.json → data.json.bak
     ★ 데이터 급감 감지 시 .safety 백업 생성 (덮어쓰기 방지)"""
-    with _data_lock:
+    import shutil
+    data = _load_data()
+    with _snapshot_lock:
         bak = Path(str(DATA_FILE) + ".bak")
         bak2 = Path(str(DATA_FILE) + ".bak2")
         safety = Path(str(DATA_FILE) + ".safety")
@@ -991,7 +1987,6 @@ def _save_data(data):
                         except:
                             pass
                     if save_safety:
-                        import shutil
                         shutil.copy2(str(DATA_FILE), str(safety))
                         print(f"  [⚠ 안전백업] 대기열 급감 감지! ({old_count}→{new_count}) .safety 백업 생성")
             except:
@@ -1000,11 +1995,9 @@ def _save_data(data):
         try:
             # 백업 순환: .bak → .bak2
             if bak.exists():
-                import shutil
                 shutil.copy2(str(bak), str(bak2))
             # 현재 data.json → .bak
             if DATA_FILE.exists():
-                import shutil
                 shutil.copy2(str(DATA_FILE), str(bak))
         except Exception as e:
             print(f"  [백업] 회전 실패 (무시): {e}")
@@ -1013,10 +2006,7 @@ def _save_data(data):
         try:
             with open(tmp, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
-            # Windows에서 rename 전에 기존 파일 삭제 필요
-            if DATA_FILE.exists():
-                DATA_FILE.unlink()
-            tmp.rename(DATA_FILE)
+            tmp.replace(DATA_FILE)
         except Exception as e:
             print(f"  [저장] 안전 쓰기 실패, 직접 쓰기 시도: {e}")
             try:
@@ -1025,7 +2015,7 @@ def _save_data(data):
             except Exception as e2:
                 print(f"  [저장] 직접 쓰기도 실패: {e2}")
 
-        # 1차 백업: 매 저장 시 auto 폴더에 백업
+        # 1차 백업: 스냅샷마다 auto 폴더에 백업
         try:
             _tiered_backup("auto")
         except:
@@ -1034,6 +2024,8 @@ def _save_data(data):
 def _url_id(url: str) -> str:
     return hashlib.md5(url.encode()).hexdigest()
 
+_init_db()
+
 # ──────────────────────────────────────────────
 # 시간차 백업 시스템 (5단계)
 # 1차: 매 저장 시 (auto)
@@ -1093,17 +2085,18 @@ DEFAULT_SETTINGS = {
     "alwaysOnTop": False,
     "windowWidth": 1400,
     "windowHeight": 850,
+    "preextractWorkers": 3,     # 사전 추출 동시 워커 수
+    "preextractPerDomain": 2,   # 같은 도메인 동시 추출 수
+    "upstreamPoolSize": 16,     # CDN 호스트당 유지할 keep-alive 연결 수
+    "segmentCacheMB": 1024,     # HLS 세그먼트 디스크 캐시 용량 (0이면 사용 안 함)
 }
 
 def _load_settings():
-    data = _load_data()
-    saved = data.get("settings", {})
+    saved = _settings_get()
     return {**DEFAULT_SETTINGS, **saved}
 
 def _save_settings(settings):
-    data = _load_data()
-    data["settings"] = settings
-    _save_data(data)
+    _settings_put(settings)
 
 # ──────────────────────────────────────────────
 # yt-dlp 헬퍼
@@ -1130,16 +2123,233 @@ def _ydl_opts(extract_only=True):
         opts["skip_download"] = True
     return opts
 
+# ──────────────────────────────────────────────
+# 업스트림 HTTP 연결 풀 (CDN 세그먼트/M3U8/직접 스트림)
+# 모든 CDN 요청이 하나의 requests.Session을 공유해 호스트별 keep-alive 연결을 재사용합니다.
+# 호스트당 연결 수는 설정 upstreamPoolSize (처음 사용할 때 읽음)
+# ──────────────────────────────────────────────
+_UPSTREAM_POOL_HOSTS = 32    # 연결 풀을 유지할 호스트 수
+_upstream_lock = threading.Lock()
+_upstream_session = None
+_upstream_stats = {"requests": 0, "errors": 0}
+
+def _upstream():
+    """공용 업스트림 세션을 반환합니다. (스레드 간 공유, urllib3 풀이 호스트별 연결을 관리)"""
+    global _upstream_session
+    with _upstream_lock:
+        if _upstream_session is None:
+            from requests.adapters import HTTPAdapter
+            size = max(4, int(_load_settings().get("upstreamPoolSize", 16)))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=_UPSTREAM_POOL_HOSTS, pool_maxsize=size,
+                                  pool_block=False, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _upstream_session = session
+        return _upstream_session
+
+def _upstream_get(url, **kwargs):
+    with _upstream_lock:
+        _upstream_stats["requests"] += 1
+    try:
+        return _upstream().get(url, **kwargs)
+    except Exception:
+        with _upstream_lock:
+            _upstream_stats["errors"] += 1
+        raise
+
+def _stream_body(resp, chunk_size):
+    """업스트림 응답을 청크로 넘기고, 클라이언트가 중간에 끊어도 연결을 풀에 돌려줍니다."""
+    try:
+        yield from resp.iter_content(chunk_size=chunk_size)
+    finally:
+        resp.close()
+
+def _upstream_pool_snapshot():
+    with _upstream_lock:
+        stats = dict(_upstream_stats)
+        session = _upstream_session
+    if session is not None:
+        adapter = session.get_adapter("https://")
+        stats["pool_maxsize"] = adapter._pool_maxsize
+        stats["hosts"] = len(adapter.poolmanager.pools)
+    return stats
+
+# ──────────────────────────────────────────────
+# 메모리 캐시 (LRU + TTL + 항목 수/바이트 상한)
+# ──────────────────────────────────────────────
+_CACHES = {}                 # 이름 -> BoundedCache (통계 API / 주기적 정리용)
+_CACHE_SWEEP_INTERVAL = 60   # 만료 항목 정리 주기(초)
+
+def _approx_size(obj, _depth=0):
+    """캐시 바이트 상한 계산용 대략적인 객체 크기."""
+    if isinstance(obj, (str, bytes)):
+        return len(obj) + 50
+    if _depth > 8:
+        return 64
+    if isinstance(obj, dict):
+        return 100 + sum(_approx_size(k, _depth + 1) + _approx_size(v, _depth + 1) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return 60 + sum(_approx_size(v, _depth + 1) for v in obj)
+    return 32
+
+class BoundedCache:
+    """스레드 안전 LRU 캐시. ttl(초)이 지난 항목은 읽을 때 버리고 주기적으로도 정리하며,
+    max_entries / max_bytes를 넘으면 가장 오래 안 쓴 항목부터 내보냅니다.
+    on_evict(key, value)는 상한/만료로 버려진 항목마다 잠금 밖에서 호출됩니다. (디스크 파일 정리 등)"""
+
+    def __init__(self, name, max_entries, max_bytes=None, ttl=None, sizeof=_approx_size, on_evict=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._on_evict = on_evict
+        self._data = OrderedDict()   # key -> (value, 저장 시각, 크기)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = self.misses = self.evictions = self.expired = 0
+        _CACHES[name] = self
+
+    def _drop(self, key):
+        value, _, size = self._data.pop(key)
+        self._bytes -= size
+        return value
+
+    def _notify(self, dropped):
+        if self._on_evict:
+            for key, value in dropped:
+                try:
+                    self._on_evict(key, value)
+                except Exception as e:
+                    print(f"[캐시] {self.name} 정리 콜백 오류: {e}")
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if not (self.ttl and time.time() - entry[1] >= self.ttl):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._drop(key)
+            self.expired += 1
+            self.misses += 1
+        self._notify([(key, entry[0])])
+        return default
+
+    def set(self, key, value):
+        size = self._sizeof(value) if self.max_bytes else 0
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, time.time(), size)
+            self._bytes += size
+            dropped = []
+            while self._data and (len(self._data) > self.max_entries
+                                  or (self.max_bytes and self._bytes > self.max_bytes)):
+                oldest = next(iter(self._data))
+                dropped.append((oldest, self._drop(oldest)))
+                self.evictions += 1
+        self._notify(dropped)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._drop(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def sweep(self):
+        """만료 항목을 정리하고 정리한 수를 반환합니다."""
+        if not self.ttl:
+            return 0
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            stale = [k for k, (_, stored_at, _) in self._data.items() if stored_at < cutoff]
+            dropped = [(k, self._drop(k)) for k in stale]
+            self.expired += len(stale)
+        self._notify(dropped)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data), "max_entries": self.max_entries,
+                "bytes": self._bytes, "max_bytes": self.max_bytes, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+                "evictions": self.evictions, "expired": self.expired,
+            }
+
+def _cache_sweeper_loop():
+    while True:
+        time.sleep(_CACHE_SWEEP_INTERVAL)
+        for cache in list(_CACHES.values()):
+            try:
+                cache.sweep()
+            except Exception as e:
+                print(f"[캐시] {cache.name} 정리 오류: {e}")
+        _extract_disk_prune()
+
+# ── 동시 요청 합치기 (single-flight) ──
+# 같은 URL의 추출/M3U8 요청이 동시에 들어오면 먼저 온 호출 하나만 실행하고 나머지는 그 결과를 기다립니다.
+_inflight_lock = threading.Lock()
+_inflight = {}   # (종류, key) -> {"done": Event, "result": ..., "error": ...}
+
+def _single_flight(kind, key, fn):
+    """진행 중인 같은 (kind, key) 호출이 있으면 그 결과(또는 예외)를 공유하고, 없으면 fn()을 실행합니다."""
+    with _inflight_lock:
+        call = _inflight.get((kind, key))
+        leader = call is None
+        if leader:
+            call = _inflight[(kind, key)] = {"done": threading.Event(), "result": None, "error": None}
+    if not leader:
+        print(f"[합치기] 진행 중인 {kind} 결과 대기 ({str(key)[:60]}...)")
+        call["done"].wait()
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+    try:
+        call["result"] = fn()
+        return call["result"]
+    except Exception as e:
+        call["error"] = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop((kind, key), None)
+        call["done"].set()
+
 # 추출 결과 캐시 (같은 영상 재생 시 즉시 시작)
-_extract_cache = {}  # url -> {"info": ..., "time": ...}
 _CACHE_TTL = 21600  # 6시간
+_extract_cache = BoundedCache("extract", max_entries=500, max_bytes=64 * 1024 * 1024, ttl=_CACHE_TTL)
 
 # M3U8 컨텐츠 캐시 (처리된 M3U8를 메모리에 저장)
-_m3u8_content_cache = {}  # video_url -> {"content": str, "time": float}
 _M3U8_CONTENT_TTL = 7200  # 2시간
+_m3u8_content_cache = BoundedCache("m3u8", max_entries=200, max_bytes=32 * 1024 * 1024,
+                                   ttl=_M3U8_CONTENT_TTL)
+
+# 파싱된 M3U8 모델 캐시 (원래 playlist URL -> playlist.Playlist): 미리 받기/예열/구간 다운로드가 함께 사용
+_m3u8_models = BoundedCache("m3u8_models", max_entries=200, max_bytes=64 * 1024 * 1024, ttl=_M3U8_CONTENT_TTL,
+                            sizeof=lambda pl: 500 + sum(len(u) + 150 for u in pl.urls))
 
-# HLS 세그먼트 프록시용 헤더 캐시
-_segment_headers_cache = {}  # netloc -> {headers}
+# HLS 세그먼트 프록시용 헤더 캐시 (netloc -> {headers})
+_segment_headers_cache = BoundedCache("segment_headers", max_entries=512, ttl=_CACHE_TTL)
 
 def _fetch_and_cache_m3u8(video_url, headers):
     """
@@ -1149,106 +2359,338 @@ def _fetch_and_cache_m3u8(video_url, headers):
     - CDN 헤더(Referer 등)를 _segment_headers_cache에 저장
     """
     # 캐시 확인
-    if video_url in _m3u8_content_cache:
-        cached = _m3u8_content_cache[video_url]
-        if time.time() - cached["time"] < _M3U8_CONTENT_TTL:
-            return cached["content"]
-
-    resp = requests.get(video_url, headers=headers, timeout=15)
+    cached = _m3u8_content_cache.get(video_url)
+    if cached is not None:
+        return cached
+    return _single_flight("m3u8", video_url, lambda: _load_m3u8(video_url, headers))
+
+def _m3u8_model(video_url, headers):
+    """M3U8를 파싱한 playlist.Playlist. 없으면 _fetch_and_cache_m3u8과 같은 경로로 받아 채웁니다."""
+    model = _m3u8_models.get(video_url)
+    if model is None:
+        _single_flight("m3u8", video_url, lambda: _load_m3u8(video_url, headers))
+        model = _m3u8_models.get(video_url)
+    return model
+
+def _load_m3u8(video_url, headers):
+    """CDN에서 M3U8를 받아 프록시 경로로 바꾼 뒤 캐시합니다. (_fetch_and_cache_m3u8 전용)"""
+    resp = _upstream_get(video_url, headers=headers, timeout=15)
     resp.raise_for_status()
 
     # 세그먼트 프록시에 사용할 헤더 저장
     parsed = urllib.parse.urlparse(video_url)
     origin_domain = f"{parsed.scheme}://{parsed.netloc}"
-    _segment_headers_cache[parsed.netloc] = {
+    seg_headers = {
         k: v for k, v in headers.items()
         if k.lower() in ('user-agent', 'referer', 'origin', 'cookie')
     }
-    if 'Referer' not in _segment_headers_cache[parsed.netloc] and 'referer' not in _segment_headers_cache[parsed.netloc]:
-        _segment_headers_cache[parsed.netloc]['Referer'] = origin_domain + '/'
-
-    content = resp.text
-    base_url = video_url.rsplit('/', 1)[0] + '/'
-    lines = content.split('\n')
-    fixed_lines = []
-    for line in lines:
-        line = line.strip()
-        if line and not line.startswith('#'):
-            # 상대 URL → 절대 URL
-            if not line.startswith('http'):
-                line = base_url + line
-            # 절대 URL을 프록시 경로로 교체
-            line = '/api/ts-proxy/s.ts?url=' + urllib.parse.quote(line, safe='')
-        elif line.startswith('#') and 'URI="' in line:
-            # #EXT-X-KEY 등의 URI 속성도 프록시 경로로 교체
-            import re as _re
-            def _replace_uri(m):
-                uri = m.group(1)
-                if not uri.startswith('http'):
-                    uri = base_url + uri
-                return 'URI="/api/ts-proxy/s.ts?url=' + urllib.parse.quote(uri, safe='') + '"'
-            line = _re.sub(r'URI="([^"]+)"', _replace_uri, line)
-        fixed_lines.append(line)
-
-    result = '\n'.join(fixed_lines)
-    _m3u8_content_cache[video_url] = {"content": result, "time": time.time()}
+    if 'Referer' not in seg_headers and 'referer' not in seg_headers:
+        seg_headers['Referer'] = origin_domain + '/'
+    _segment_headers_cache.set(parsed.netloc, seg_headers)
+
+    # 한 번 파싱한 모델에서 재작성: 상대 URL → 절대 URL, 모든 세그먼트/서브 playlist/키 URI → 프록시 경로 (playlist.py)
+    # VOD/master playlist는 짧은 번호 경로(/api/ts-proxy/<키>/<번호>.ts)로 쓰고 번호 → URL 표를 남깁니다.
+    # 라이브 media playlist는 갱신 때마다 번호가 밀리므로 전체 URL 경로를 유지합니다.
+    text = resp.text
+    model = playlist.parse(text, video_url)
+    _m3u8_models.set(video_url, model)
+    if model.fixed:
+        pkey = _playlist_key(video_url)
+        result = model.render(compact_prefix=f"/api/ts-proxy/{pkey}")
+        _segment_table_put(pkey, video_url, model.urls, {'User-Agent': USER_AGENT, **seg_headers})
+    else:
+        result = model.render()
+    _m3u8_content_cache.set(video_url, result)
     return result
 
+# ──────────────────────────────────────────────
+# 사전 추출 스케줄러 (우선순위 + 도메인별 동시 실행 제한)
+# stream_url이 없는 항목을 워커 풀이 우선순위 순으로 추출합니다.
+#   0: 재생 중인 항목 바로 뒤 (_preextract_focus)  1: 새로 추가된 항목  2: 시작 시 밀린 항목
+# 결과는 _PREEXTRACT_BATCH개씩 모아 한 번에 대기열에 반영합니다. (우선순위 0이거나 할 일이 없으면 즉시)
+# 워커 수/도메인당 동시 수는 설정 preextractWorkers / preextractPerDomain
+# ──────────────────────────────────────────────
+_PRE_PRIO_FOCUS = 0
+_PRE_PRIO_NEW = 1
+_PRE_PRIO_BACKLOG = 2
+_PREEXTRACT_BATCH = 10
+_PREEXTRACT_FOCUS_AHEAD = 5   # 재생 항목 뒤로 몇 개를 먼저 추출할지
+_pre_cond = threading.Condition()
+_pre_heap = []                # (우선순위, 순번, item_id, url) — 우선순위가 바뀐 옛 항목은 꺼낼 때 무시
+_pre_prio = {}                # item_id -> 대기 중 우선순위
+_pre_running = set()          # 추출 중인 item_id
+_pre_domain_active = {}       # netloc -> 추출 중 수
+_pre_results = {}             # item_id -> 반영 대기 필드
+_pre_refresh = set()          # stream_url이 있어도 다시 추출할 item_id (만료 임박)
+_pre_seq = itertools.count()
+_pre_limits = {"workers": 3, "per_domain": 2}
+_pre_worker_count = 0
+
+def _preextract_enqueue(items, prio, refresh=False):
+    """items: [(item_id, url)]. 이미 대기 중이면 더 높은 우선순위로만 갱신합니다.
+    refresh=True면 stream_url이 있어도 캐시 없이 다시 추출합니다."""
+    global _pre_worker_count
+    settings = _load_settings()
+    with _pre_cond:
+        _pre_limits["workers"] = max(1, int(settings.get("preextractWorkers", 3)))
+        _pre_limits["per_domain"] = max(1, int(settings.get("preextractPerDomain", 2)))
+        for uid, url in items:
+            if uid in _pre_running:
+                continue
+            # 갱신 표시는 이 항목의 대기 작업이 있을 때만 (새로 넣었거나 이미 대기 중) — 실행 중이면 남기지 않음
+            if refresh:
+                _pre_refresh.add(uid)
+            if _pre_prio.get(uid, prio + 1) <= prio:
+                continue
+            _pre_prio[uid] = prio
+            heapq.heappush(_pre_heap, (prio, next(_pre_seq), uid, url))
+        while _pre_worker_count < _pre_limits["workers"]:
+            _pre_worker_count += 1
+            threading.Thread(target=_preextract_worker, daemon=True,
+                             name=f"PreExtract-{_pre_worker_count}").start()
+        _pre_cond.notify_all()
+
+def _preextract_focus(uid):
+    """재생이 시작된 항목 뒤쪽의 미추출 항목을 최우선으로 올립니다."""
+    ahead = [(it["id"], it["url"]) for it in _queue_after(uid, _PREEXTRACT_FOCUS_AHEAD)
+             if not it.get("stream_url")]
+    if ahead:
+        _preextract_enqueue(ahead, _PRE_PRIO_FOCUS)
+
+def _preextract_next():
+    """도메인 제한에 걸리지 않는 가장 급한 작업을 꺼냅니다. (_pre_cond 보유 상태)"""
+    skipped = []
+    job = None
+    while _pre_heap:
+        entry = heapq.heappop(_pre_heap)
+        prio, _, uid, url = entry
+        if _pre_prio.get(uid) != prio:
+            continue
+        domain = urllib.parse.urlparse(url).netloc
+        if _pre_domain_active.get(domain, 0) >= _pre_limits["per_domain"]:
+            skipped.append(entry)
+            continue
+        job = (prio, uid, url, domain, uid in _pre_refresh)
+        break
+    for entry in skipped:
+        heapq.heappush(_pre_heap, entry)
+    if job:
+        _pre_refresh.discard(job[1])
+        del _pre_prio[job[1]]
+        _pre_running.add(job[1])
+        _pre_domain_active[job[3]] = _pre_domain_active.get(job[3], 0) + 1
+    return job
+
+def _preextract_one(uid, url, refresh=False):
+    """항목 1개를 추출해 반영할 필드를 돌려줍니다. 이미 준비됐거나 삭제된 항목은 None."""
+    item = _queue_find(uid)
+    if not item or (item.get("stream_url") and not refresh):
+        return None
+    info = _extract_info(url, use_cache=not refresh)
+    video_url = info.get("url", "")
+    if not video_url:
+        return None
+    # M3U8 도 미리 캐시
+    headers = {'User-Agent': USER_AGENT}
+    headers.update(info.get("http_headers", {}))
+    if '.m3u8' in video_url:
+        try:
+            _fetch_and_cache_m3u8(video_url, headers)
+        except Exception:
+            pass
+    print(f"[사전 추출] ✓ {'(갱신) ' if refresh else ''}{item.get('title', '?')[:40]}")
+    return {"stream_url": video_url, "http_headers": info.get("http_headers", {}),
+            "variants": info.get("_variants", []), "_extracted_at": time.time()}
+
+def _preextract_worker():
+    global _pre_worker_count
+    while True:
+        with _pre_cond:
+            job = None
+            while job is None:
+                if _pre_worker_count > _pre_limits["workers"]:
+                    _pre_worker_count -= 1   # 설정으로 워커 수가 줄어든 경우
+                    return
+                job = _preextract_next()
+                if job is None:
+                    _pre_cond.wait(timeout=30)
+        prio, uid, url, domain, refresh = job
+        fields = None
+        try:
+            fields = _preextract_one(uid, url, refresh)
+        except Exception as e:
+            print(f"[사전 추출] ✗ {url[:60]}: {e}")
+        batch = None
+        with _pre_cond:
+            _pre_running.discard(uid)
+            _pre_refresh.discard(uid)
+            _pre_domain_active[domain] -= 1
+            if fields:
+                _pre_results[uid] = fields
+            idle = not _pre_prio and not _pre_running
+            if _pre_results and (prio == _PRE_PRIO_FOCUS or idle
+                                 or len(_pre_results) >= _PREEXTRACT_BATCH):
+                batch = dict(_pre_results)
+                _pre_results.clear()
+            _pre_cond.notify_all()
+        if batch:
+            # 모은 결과를 한 번에 반영하고 곧바로 DB 플러시
+            changed = _queue_update_many(batch)
+            _flush_wake.set()
+            print(f"[사전 추출] {len(changed)}개 항목 반영" + (" (대기 작업 없음)" if idle else ""))
+
 def _background_preextract():
-    """서버 시작 시 stream_url이 없는 대기열 항목을 백그라운드로 추출합니다."""
+    """서버 시작 시 stream_url이 없는 대기열 항목을 대기열 순서대로 스케줄러에 넣습니다."""
     time.sleep(3)  # 서버 시작 대기
     try:
-        data = _load_data()
-        urls_to_extract = []
-        for item in data.get("queue", []):
-            if not item.get("stream_url"):
-                urls_to_extract.append({"url": item["url"], "title": item.get("title", "?"), "id": item["id"]})
-        if not urls_to_extract:
+        pending = [(item["id"], item["url"]) for item in _queue_items() if not item.get("stream_url")]
+        if not pending:
             print("[사전 추출] 모든 항목이 준비됨")
             return
-        print(f"[사전 추출] {len(urls_to_extract)}개 항목 처리 시작...")
-        success = 0
-        for item_ref in urls_to_extract:
-            try:
-                info = _extract_info(item_ref["url"])
-                video_url = info.get("url", "")
-                if video_url:
-                    # ★ 매번 최신 데이터를 다시 로드해서 저장 (race condition 방지)
-                    fresh_data = _load_data()
-                    for q in fresh_data.get("queue", []):
-                        if q["id"] == item_ref["id"]:
-                            q["stream_url"] = video_url
-                            q["http_headers"] = info.get("http_headers", {})
-                            q["variants"] = info.get("_variants", [])
-                            q["_extracted_at"] = time.time()
-                            break
-                    _save_data(fresh_data)
-                    # M3U8 도 미리 캐시
-                    headers = {'User-Agent': USER_AGENT}
-                    headers.update(info.get("http_headers", {}))
-                    if '.m3u8' in video_url:
-                        try:
-                            _fetch_and_cache_m3u8(video_url, headers)
-                        except:
-                            pass
-                    success += 1
-                    print(f"[사전 추출] ✓ {item_ref['title'][:40]}")
-            except Exception as e:
-                print(f"[사전 추출] ✗ {item_ref['title'][:40]}: {e}")
-            time.sleep(0.5)  # 서버 부하 방지
-        print(f"[사전 추출] 완료 ({success}/{len(urls_to_extract)} 성공)")
+        _preextract_enqueue(pending, _PRE_PRIO_BACKLOG)
+        print(f"[사전 추출] {len(pending)}개 항목 예약 (워커 {_pre_limits['workers']}개, "
+              f"도메인당 {_pre_limits['per_domain']}개)")
     except Exception as e:
         print(f"[사전 추출] 오류: {e}")
 
+# ──────────────────────────────────────────────
+# 스트림 URL 만료 추적 + 선제 갱신
+# 만료 시각은 URL의 토큰 파라미터(expires/exp/X-Amz-Expires 등)에서 읽고, 없으면
+# CDN(netloc)별로 관측한 수명(저장된 URL이 실패했을 때의 나이)을 씁니다. (meta.cdn_expiry에 보존)
+# StreamRefresh 스레드가 재생 중/다음 항목과 최근 재생 항목 중 만료 임박한 것을
+# 사전 추출 스케줄러에 갱신 작업으로 넣습니다.
+# ──────────────────────────────────────────────
+_REFRESH_INTERVAL_SEC = 60
+_REFRESH_LEAD_SEC = 600          # 만료 이만큼 전에 갱신
+_REFRESH_AHEAD = 5               # 재생 중 항목 뒤로 몇 개까지
+_REFRESH_RECENT = 10             # 최근 재생 항목 몇 개까지
+_REFRESH_RECENT_WINDOW = 24 * 3600
+_CDN_MIN_LIFETIME = 300          # 이보다 짧은 실패는 만료가 아닌 일시 오류로 간주
+_EXPIRY_PARAMS = {"expires", "expire", "validto", "valid_to", "deadline",
+                  "x-expires", "token_expires", "expiry"}
+# 짧은 이름은 다른 뜻(e=에피소드, t=시작 시각 등)으로도 쓰이므로 값이 그럴듯한 epoch 시각일 때만 인정
+_EPOCH_PARAMS = {"exp", "e", "t", "st"}
+_EPOCH_MAX_AHEAD = 10 * 365 * 86400
+_EXPIRY_TOKEN_RE = re.compile(r'(?:exp|expires)[=_~:](\d{10,13})', re.I)
+_cdn_expiry_lock = threading.Lock()
+_cdn_expiry = None               # netloc -> 관측된 수명(초), 최초 사용 시 meta에서 로드
+_last_streamed_uid = None        # 마지막으로 /api/stream을 요청한 항목
+
+def _cdn_lifetimes():
+    global _cdn_expiry
+    with _cdn_expiry_lock:
+        if _cdn_expiry is None:
+            _cdn_expiry = _meta_get("cdn_expiry", {})
+        return _cdn_expiry
+
+def _epoch_value(value):
+    """10자리(초) 또는 13자리(밀리초) 숫자이고 2001년 ~ 10년 뒤 사이면 epoch 초, 아니면 None."""
+    if not value.isdigit() or len(value) not in (10, 13):
+        return None
+    ts = int(value) / (1000 if len(value) == 13 else 1)
+    return ts if ts <= time.time() + _EPOCH_MAX_AHEAD else None
+
+def _stream_expiry(stream_url, extracted_at):
+    """stream_url의 만료 시각(epoch 초) 추정. 알 수 없으면 None."""
+    if not stream_url or not extracted_at:
+        return None
+    parsed = urllib.parse.urlparse(stream_url)
+    for key, values in urllib.parse.parse_qs(parsed.query).items():
+        key = key.lower()
+        if key in _EPOCH_PARAMS:
+            ts = _epoch_value(values[0])
+            if ts:
+                return ts
+            continue
+        if key not in _EXPIRY_PARAMS and key != "x-amz-expires":
+            continue
+        try:
+            value = float(values[0])
+        except (ValueError, IndexError):
+            continue
+        if key == "x-amz-expires" or 0 < value < 1e7:
+            return extracted_at + value          # 상대 초
+        if value > 1e12:
+            value /= 1000                        # 밀리초
+        if value > 1e9:
+            return value
+    m = _EXPIRY_TOKEN_RE.search(parsed.path + "?" + parsed.query)
+    if m:
+        value = float(m.group(1))
+        return value / 1000 if value > 1e12 else value
+    lifetime = _cdn_lifetimes().get(parsed.netloc)
+    return extracted_at + lifetime if lifetime else None
+
+def _stream_expiry_observe(stream_url, extracted_at):
+    """저장된 stream_url이 실패했을 때 그 나이를 해당 CDN의 수명 상한으로 기록합니다."""
+    if not extracted_at:
+        return
+    age = time.time() - extracted_at
+    if age < _CDN_MIN_LIFETIME:
+        return
+    netloc = urllib.parse.urlparse(stream_url).netloc
+    lifetimes = _cdn_lifetimes()
+    with _cdn_expiry_lock:
+        prev = lifetimes.get(netloc)
+        if prev is not None and prev <= age:
+            return
+        lifetimes[netloc] = round(age)
+        snapshot = dict(lifetimes)
+    _meta_put("cdn_expiry", snapshot)
+    print(f"[만료 추적] {netloc} 수명 ≈ {age / 60:.0f}분으로 학습")
+
+def _stream_refresh_scan():
+    """만료 임박 항목을 찾아 갱신 예약합니다. 예약한 수 반환."""
+    now = time.time()
+    upcoming = []
+    if _last_streamed_uid:
+        current = _queue_find(_last_streamed_uid)
+        upcoming = ([current] if current else []) + _queue_after(_last_streamed_uid, _REFRESH_AHEAD)
+    recent = [it for it in map(_queue_find, _playback_recent(_REFRESH_RECENT, _REFRESH_RECENT_WINDOW)) if it]
+    focus, later = [], []
+    seen = set()
+    for bucket, items in ((focus, upcoming), (later, recent)):
+        for it in items:
+            if it["id"] in seen or not it.get("stream_url"):
+                continue
+            seen.add(it["id"])
+            expires = _stream_expiry(it["stream_url"], it.get("_extracted_at"))
+            if expires and expires - now < _REFRESH_LEAD_SEC:
+                bucket.append((it["id"], it["url"]))
+    if focus:
+        _preextract_enqueue(focus, _PRE_PRIO_FOCUS, refresh=True)
+    if later:
+        _preextract_enqueue(later, _PRE_PRIO_NEW, refresh=True)
+    return len(focus) + len(later)
+
+def _stream_refresh_loop():
+    while True:
+        time.sleep(_REFRESH_INTERVAL_SEC)
+        try:
+            n = _stream_refresh_scan()
+            if n:
+                print(f"[만료 추적] 만료 임박 {n}개 항목 갱신 예약")
+        except Exception as e:
+            print(f"[만료 추적] 오류: {e}")
+
 def _extract_info(url: str, use_cache=True):
     """URL에서 영상 정보를 추출합니다. 커스텀 도메인은 바로 커스텀 추출기 사용."""
     # 캐시 확인
-    if use_cache and url in _extract_cache:
-        cached = _extract_cache[url]
-        if time.time() - cached["time"] < _CACHE_TTL:
+    if use_cache:
+        cached = _extract_cache.get(url)
+        if cached is not None:
             print(f"[캐시] 추출 결과 캐시 사용 ({url[:60]}...)")
-            return cached["info"]
+            return cached
+        cached = _extract_disk_get(url)
+        if cached is not None:
+            print(f"[캐시] 디스크 추출 캐시 사용 ({url[:60]}...)")
+            _extract_cache.set(url, cached)
+            return cached
+    return _single_flight("extract", url, lambda: _extract_info_fresh(url))
 
+
+def _extract_info_fresh(url: str):
+    """캐시를 보지 않고 추출해 메모리/디스크 캐시에 저장합니다. (_extract_info 전용)"""
     parsed = urllib.parse.urlparse(url)
     is_custom = any(d in parsed.netloc for d in CUSTOM_DOMAINS)
 
@@ -1256,7 +2698,8 @@ def _extract_info(url: str, use_cache=True):
     if is_custom:
         print(f"[커스텀 도메인] {parsed.netloc} → 커스텀 추출기 바로 사용")
         info = _custom_extract(url)
-        _extract_cache[url] = {"info": info, "time": time.time()}
+        _extract_cache.set(url, info)
+        _extract_disk_put(url, info)
         return info
 
     # 그 외 사이트는 yt-dlp 시도
@@ -1265,7 +2708,9 @@ def _extract_info(url: str, use_cache=True):
         with yt_dlp.YoutubeDL(opts) as ydl:
             info = ydl.extract_info(url, download=False)
         if info and (info.get("url") or info.get("formats")):
-            _extract_cache[url] = {"info": info, "time": time.time()}
+            _extract_cache.set(url, info)
+            if info.get("url"):
+                _extract_disk_put(url, info)
             return info
     except Exception as e:
         raise
@@ -1285,9 +2730,244 @@ def _load_cookies_into_session(session):
             print(f"[쿠키 로드 실패] {e}")
 
 
+# ── curl_cffi 세션 풀 ──
+# (netloc, 쿠키 출처)별로 curl_cffi 세션 하나를 계속 재사용합니다. (keep-alive, chrome 위장 → HTTP/2)
+# 쿠키는 세션을 만들 때 한 번 넣고, CF 차단이 감지됐을 때만 다시 읽어 cf_clearance가 바뀌었으면 재시도합니다.
+# curl_cffi 세션은 스레드 안전하지 않으므로 세션마다 잠금을 두고, curl 핸들 하나를 모든 요청 스레드가
+# 함께 쓰게 만듭니다(use_thread_local_curl=False). → Flask 요청 스레드가 바뀌어도 연결이 재사용됨.
+# 같은 사이트 요청은 직렬화되지만 페이지 요청은 드물어 문제되지 않습니다.
+# 재사용 효과는 /api/pool/stats의 cold_ms(세션 첫 요청) / warm_ms(이후 요청) 평균으로 확인합니다.
+_cf_pool_lock = threading.Lock()
+_cf_pool = {}   # (netloc, method) -> {"session", "lock", "source", "cf", "created", "uses"}
+_cf_pool_stats = {"created": 0, "reused": 0, "cookie_reloads": 0, "dropped": 0}
+_cf_timing = {"cold": [0, 0.0], "warm": [0, 0.0]}   # 종류 -> [요청 수, 누적 초]
+
+def _cf_new_session():
+    from curl_cffi import requests as cf_requests
+    try:
+        return cf_requests.Session(impersonate="chrome", use_thread_local_curl=False)
+    except TypeError:   # 옵션이 없는 curl_cffi: 스레드별 핸들 (잠금으로 안전성만 보장)
+        return cf_requests.Session(impersonate="chrome")
+
+def _cf_get(entry, url, headers, timeout=30):
+    """풀 세션으로 GET (세션 잠금 안에서). 첫 요청/이후 요청 소요 시간을 따로 집계합니다."""
+    with entry["lock"]:
+        kind = "warm" if entry["requests"] else "cold"
+        t0 = time.perf_counter()
+        resp = entry["session"].get(url, headers=headers, timeout=timeout)
+        elapsed = time.perf_counter() - t0
+        entry["requests"] += 1
+    with _cf_pool_lock:
+        _cf_timing[kind][0] += 1
+        _cf_timing[kind][1] += elapsed
+    return resp
+
+def _cf_load_jar(method):
+    """쿠키 출처별 jar 로드. (jar, 출처 이름), 없으면 (None, '')"""
+    if method == "browser":
+        return _build_cookie_jar_from_browser()
+    if not COOKIES_FILE.exists():
+        return None, ''
+    from http.cookiejar import MozillaCookieJar
+    cj = MozillaCookieJar(str(COOKIES_FILE))
+    cj.load(ignore_discard=True, ignore_expires=True)
+    return cj, 'cookies.txt'
+
+def _cf_inject_cookies(session, jar, netloc):
+    """jar에서 netloc에 보낼 수 있는 도메인(같거나 상위 도메인) 쿠키만 세션에 넣고 (개수, cf_clearance 값)을 반환합니다."""
+    host = netloc.split(':', 1)[0].lower()
+    loaded, cf = 0, None
+    for cookie in jar:
+        cd = cookie.domain.lstrip('.').lower()
+        if cd and (host == cd or host.endswith('.' + cd)):
+            session.cookies.set(cookie.name, cookie.value, domain=cookie.domain)
+            loaded += 1
+            if cookie.name == 'cf_clearance':
+                cf = cookie.value
+    return loaded, cf
+
+def _cf_session(netloc, method, reload=False):
+    """풀의 세션을 반환합니다. 처음 만들 때와 reload=True일 때만 쿠키를 읽습니다. 쿠키가 없으면 None."""
+    key = (netloc, method)
+    with _cf_pool_lock:
+        entry = _cf_pool.get(key)
+        if entry and not reload:
+            entry["uses"] += 1
+            _cf_pool_stats["reused"] += 1
+            return entry
+    jar, source = _cf_load_jar(method)
+    if not jar:
+        return None
+    if entry:
+        with entry["lock"]:
+            loaded, cf = _cf_inject_cookies(entry["session"], jar, netloc)
+    else:
+        session = _cf_new_session()
+        loaded, cf = _cf_inject_cookies(session, jar, netloc)
+        if not loaded:
+            _cf_close_session(session)
+    if not loaded:
+        return None
+    print(f"[세션 풀] {netloc} ← {source} 쿠키 {loaded}개 (cf_clearance: {'✓' if cf else '✗'})")
+    loser = None
+    with _cf_pool_lock:
+        if entry:
+            entry.update(source=source, cf=cf)
+            entry["uses"] += 1
+            _cf_pool_stats["cookie_reloads"] += 1
+        elif key in _cf_pool:
+            # 다른 스레드가 먼저 만들었으면 그 세션을 쓰고 방금 만든 것은 닫음
+            loser = session
+            entry = _cf_pool[key]
+            entry["uses"] += 1
+            _cf_pool_stats["reused"] += 1
+        else:
+            entry = {"session": session, "lock": threading.Lock(), "source": source, "cf": cf,
+                     "created": time.time(), "uses": 1, "requests": 0}
+            _cf_pool[key] = entry
+            _cf_pool_stats["created"] += 1
+    if loser is not None:
+        _cf_close_session(loser)
+    return entry
+
+def _cf_close_session(session):
+    try:
+        session.close()
+    except Exception as e:
+        print(f"[세션 풀] 세션 닫기 실패: {e}")
+
+def _cf_close_entry(entry):
+    """풀에서 뺀 세션을 닫습니다. 사용 중이면 그 요청이 끝날 때까지 기다립니다.
+    (_cf_pool_lock을 잡지 않은 상태에서 호출 — _cf_get이 entry 잠금 → _cf_pool_lock 순서로 잡음)"""
+    with entry["lock"]:
+        _cf_close_session(entry["session"])
+
+def _cf_session_drop(netloc, method):
+    with _cf_pool_lock:
+        entry = _cf_pool.pop((netloc, method), None)
+        if entry:
+            _cf_pool_stats["dropped"] += 1
+    if entry:
+        _cf_close_entry(entry)
+
+def _cf_pool_reset():
+    """풀의 모든 세션을 닫고 비웁니다. (쿠키를 새로 추출했을 때)"""
+    with _cf_pool_lock:
+        entries = list(_cf_pool.values())
+        _cf_pool.clear()
+        _cf_pool_stats["dropped"] += len(entries)
+    for entry in entries:
+        _cf_close_entry(entry)
+
+def _cf_fetch(url, headers, netloc, method):
+    """풀 세션으로 페이지 요청. 차단되면 쿠키를 다시 읽어 cf_clearance가 바뀐 경우에만 한 번 더 시도합니다.
+    성공 시 (resp, entry), 실패 시 None (세션은 풀에서 버림)."""
+    entry = _cf_session(netloc, method)
+    if entry is None:
+        return None
+    resp = _cf_get(entry, url, headers)
+    if resp.status_code == 200 and not _is_cf_blocked(resp.text):
+        return resp, entry
+    old_cf = entry["cf"]
+    entry = _cf_session(netloc, method, reload=True)
+    if entry and entry["cf"] and entry["cf"] != old_cf:
+        print(f"[세션 풀] {netloc} cf_clearance 갱신됨 → 재시도")
+        resp = _cf_get(entry, url, headers)
+        if resp.status_code == 200 and not _is_cf_blocked(resp.text):
+            return resp, entry
+    print(f"[세션 풀] {netloc} ({method}) CF 차단 (cf_clearance={bool(entry and entry['cf'])})")
+    _cf_session_drop(netloc, method)
+    return None
+
+def _cf_pool_snapshot():
+    now = time.time()
+    with _cf_pool_lock:
+        return {
+            **_cf_pool_stats,
+            **{f"{kind}_ms": round(total / count * 1000, 1) if count else None
+               for kind, (count, total) in _cf_timing.items()},
+            "sessions": [
+                {"netloc": netloc, "method": method, "source": e["source"], "cf_clearance": bool(e["cf"]),
+                 "uses": e["uses"], "requests": e["requests"], "age": round(now - e["created"])}
+                for (netloc, method), e in _cf_pool.items()
+            ],
+        }
+
+
+# ── CF 우회 방법 적응 순서 ──
+# netloc별로 방법마다 성공/실패를 기록해 마지막으로 성공한 방법을 먼저 시도하고,
+# 연속으로 실패한 방법은 지수 백오프(60초 → 최대 1시간) 동안 건너뜁니다. meta.cf_methods에 보존.
+_CF_METHODS = ("browser", "cookies.txt", "requests")
+_CF_METHOD_LABELS = {"browser": "방법1", "cookies.txt": "방법2", "requests": "방법3"}
+_CF_BACKOFF_BASE = 60
+_CF_BACKOFF_MAX = 3600
+_cf_method_lock = threading.Lock()
+_cf_method_table = None   # netloc -> {"last": 방법, "methods": {방법: {ok, fail, streak, next_try, last_ok}}}
+
+def _cf_methods_table():
+    global _cf_method_table
+    with _cf_method_lock:
+        if _cf_method_table is None:
+            _cf_method_table = _meta_get("cf_methods", {})
+        return _cf_method_table
+
+def _cf_method_order(netloc):
+    """이번에 시도할 방법 순서. 백오프 중인 방법은 빼되, 모두 백오프 중이면 가장 먼저 풀리는 하나만."""
+    table = _cf_methods_table()
+    now = time.time()
+    with _cf_method_lock:
+        entry = table.get(netloc, {})
+        stats = entry.get("methods", {})
+        last = entry.get("last")
+    def rank(m):
+        st = stats.get(m, {})
+        ok, fail = st.get("ok", 0), st.get("fail", 0)
+        return (m != last, -(ok + 1) / (ok + fail + 2), _CF_METHODS.index(m))
+    ready = [m for m in _CF_METHODS if stats.get(m, {}).get("next_try", 0) <= now]
+    if not ready:
+        ready = [min(_CF_METHODS, key=lambda m: stats[m]["next_try"])]
+    return sorted(ready, key=rank)
+
+def _cf_method_record(netloc, method, ok):
+    table = _cf_methods_table()
+    now = time.time()
+    with _cf_method_lock:
+        entry = table.setdefault(netloc, {"last": None, "methods": {}})
+        st = entry["methods"].setdefault(method, {"ok": 0, "fail": 0, "streak": 0, "next_try": 0, "last_ok": None})
+        if ok:
+            st["ok"] += 1
+            st["streak"] = 0
+            st["next_try"] = 0
+            st["last_ok"] = round(now)
+            entry["last"] = method
+        else:
+            st["fail"] += 1
+            st["streak"] += 1
+            st["next_try"] = round(now + min(_CF_BACKOFF_MAX, _CF_BACKOFF_BASE * 2 ** (st["streak"] - 1)))
+    _meta_mark("cf_methods", _cf_methods_snapshot)
+
+def _cf_methods_snapshot():
+    """플러시 때 호출: 방법 통계 표의 복사본."""
+    with _cf_method_lock:
+        return json.loads(json.dumps(_cf_method_table or {}))
+
+def _cf_method_report(netloc):
+    """/api/debug용: netloc의 방법별 통계와 현재 시도 순서."""
+    table = _cf_methods_table()
+    now = time.time()
+    with _cf_method_lock:
+        entry = json.loads(json.dumps(table.get(netloc, {})))
+    for st in entry.get("methods", {}).values():
+        st["backoff_sec"] = max(0, round(st["next_try"] - now))
+    entry["order"] = _cf_method_order(netloc)
+    return entry
+
+
 def _fetch_page_with_cf_bypass(url: str):
     """Cloudflare 우회하여 페이지를 가져옵니다.
-    순서: curl_cffi+브라우저쿠키 → curl_cffi+cookies.txt → requests"""
+    기본 순서: curl_cffi+브라우저쿠키 → curl_cffi+cookies.txt → requests
+    (netloc별로 마지막 성공 방법을 먼저, 연속 실패한 방법은 백오프 동안 건너뜀 — _cf_method_order)
+    (본문, 성공한 방법 키 _CF_METHODS, 표시용 방법 이름) 반환. 풀 세션은 밖으로 내주지 않습니다."""
     parsed = urllib.parse.urlparse(url)
     headers = {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
@@ -1303,68 +2983,57 @@ def _fetch_page_with_cf_bypass(url: str):
         'Upgrade-Insecure-Requests': '1',
     }
 
-    # ── 방법 1: curl_cffi + 브라우저 쿠키 (yt-dlp cookie jar) ──
-    cookie_jar, browser_name = _build_cookie_jar_from_browser()
-    if cookie_jar:
+    netloc = parsed.netloc
+    tried, last_error, blocked = [], None, None
+    for method in _cf_method_order(netloc):
+        label = _CF_METHOD_LABELS[method]
+        tried.append(method)
         try:
-            from curl_cffi import requests as cf_requests
-            session = cf_requests.Session(impersonate="chrome")
-            # cookie jar의 모든 쿠키를 세션에 추가
-            domain = parsed.netloc
-            parts = domain.split('.')
-            base = '.'.join(parts[-2:]) if len(parts) >= 2 else domain
-            loaded = 0
-            has_cf = False
-            for cookie in cookie_jar:
-                cd = cookie.domain.lstrip('.')
-                if base in cd or cd in domain:
-                    session.cookies.set(cookie.name, cookie.value, domain=cookie.domain)
-                    loaded += 1
-                    if cookie.name == 'cf_clearance':
-                        has_cf = True
-            print(f"[방법1] {browser_name}에서 {loaded}개 쿠키 로드 (cf_clearance: {'✓' if has_cf else '✗'})")
-            if loaded > 0:
-                resp = session.get(url, headers=headers, timeout=30)
-                if resp.status_code == 200 and not _is_cf_blocked(resp.text):
-                    print(f"[방법1] curl_cffi + {browser_name} 쿠키로 성공!")
-                    return resp.text, session, f'curl_cffi+{browser_name}'
-                else:
-                    print(f"[방법1] 브라우저 쿠키로도 CF 차단됨 (cf_clearance={has_cf})")
+            if method == "requests":
+                # ── 방법 3: 일반 requests ──
+                text = _plain_page_fetch(url, headers)
+                if _is_cf_blocked(text):
+                    _cf_method_record(netloc, method, False)
+                    blocked = text
+                    continue
+                _cf_method_record(netloc, method, True)
+                print(f"[{label}] requests로 성공")
+                return text, method, 'requests(폴백)'
+            # ── 방법 1: curl_cffi + 브라우저 쿠키 (yt-dlp cookie jar) / 방법 2: curl_cffi + cookies.txt ──
+            hit = _cf_fetch(url, headers, netloc, method)
+            _cf_method_record(netloc, method, bool(hit))
+            if hit:
+                resp, entry = hit
+                print(f"[{label}] curl_cffi + {entry['source']} 쿠키로 성공!")
+                return resp.text, method, f"curl_cffi+{entry['source']}"
         except ImportError:
-            print("[방법1] curl_cffi 미설치")
+            _cf_method_record(netloc, method, False)
+            print(f"[{label}] curl_cffi 미설치")
         except Exception as e:
-            print(f"[방법1 실패] {e}")
+            _cf_method_record(netloc, method, False)
+            _cf_session_drop(netloc, method)
+            last_error = e
+            print(f"[{label} 실패] {e}")
+
+    # 최후 폴백: 차단 페이지라도 requests 결과를 돌려줌 (백오프로 건너뛰었으면 한 번 시도)
+    if blocked is None and "requests" not in tried:
+        text = _plain_page_fetch(url, headers)
+        _cf_method_record(netloc, "requests", not _is_cf_blocked(text))
+        blocked = text
+    if blocked is None:
+        raise last_error or ValueError("페이지를 가져올 수 없습니다.")
+    print(f"[방법3] requests 폴백 (CF 차단 가능성 높음)")
+    return blocked, "requests", 'requests(폴백)'
 
-    # ── 방법 2: curl_cffi + cookies.txt ──
-    if COOKIES_FILE.exists():
-        try:
-            from curl_cffi import requests as cf_requests
-            session = cf_requests.Session(impersonate="chrome")
-            from http.cookiejar import MozillaCookieJar
-            cj = MozillaCookieJar(str(COOKIES_FILE))
-            cj.load(ignore_discard=True, ignore_expires=True)
-            for cookie in cj:
-                session.cookies.set(cookie.name, cookie.value, domain=cookie.domain)
-            print(f"[방법2] cookies.txt에서 {len(cj)}개 쿠키 로드")
-            resp = session.get(url, headers=headers, timeout=30)
-            if resp.status_code == 200 and not _is_cf_blocked(resp.text):
-                print(f"[방법2] curl_cffi + cookies.txt로 성공!")
-                return resp.text, session, 'curl_cffi+cookies.txt'
-            else:
-                print(f"[방법2] cookies.txt로도 CF 차단됨")
-        except ImportError:
-            print("[방법2] curl_cffi 미설치")
-        except Exception as e:
-            print(f"[방법2 실패] {e}")
 
-    # ── 방법 3: 일반 requests (최후 폴백) ──
+def _plain_page_fetch(url, headers):
+    """일반 requests로 페이지를 가져옵니다."""
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
     _load_cookies_into_session(session)
     resp = session.get(url, headers={**headers, 'User-Agent': USER_AGENT}, timeout=30)
     resp.raise_for_status()
-    print(f"[방법3] requests 폴백 (CF 차단 가능성 높음)")
-    return resp.text, session, 'requests(폴백)'
+    return resp.text
 
 
 # ── P.A.C.K.E.R. 디코딩 헬퍼 함수들 ──
@@ -1515,7 +3184,7 @@ def _select_quality(variants, quality):
 def _custom_extract(url: str):
     """hitomi.py 로직 기반 MissAV 커스텀 추출기 (Cloudflare 우회)"""
     parsed = urllib.parse.urlparse(url)
-    page, session, method = _fetch_page_with_cf_bypass(url)
+    page, cf_method, method = _fetch_page_with_cf_bypass(url)
     soup = BeautifulSoup(page, 'html.parser')
 
     # 제목 추출
@@ -1683,26 +3352,20 @@ def _custom_extract(url: str):
 
     all_variants = []
     try:
-        m3u8_resp = session.get(m3u8_url, headers=m3u8_headers, timeout=15)
+        # 페이지와 다른 호스트(CDN)이므로 m3u8 호스트 기준으로 요청: 쿠키 방법으로 통과했으면
+        # 그 호스트의 풀 세션(쿠키가 있을 때), 아니면 공용 CDN 세션
+        hit = None
+        if cf_method != "requests":
+            hit = _cf_fetch(m3u8_url, m3u8_headers, urllib.parse.urlparse(m3u8_url).netloc, cf_method)
+        m3u8_resp = hit[0] if hit else _upstream_get(m3u8_url, headers=m3u8_headers, timeout=15)
         m3u8_resp.raise_for_status()
         m3u8_content = m3u8_resp.text
 
-        if '#EXT-X-STREAM-INF:' in m3u8_content:
-            lines = m3u8_content.strip().split('\n')
-            for i, line in enumerate(lines):
-                if line.startswith('#EXT-X-STREAM-INF:'):
-                    bw = 0
-                    res = ""
-                    bw_match = re.search(r'BANDWIDTH=(\d+)', line)
-                    if bw_match:
-                        bw = int(bw_match.group(1))
-                    res_match = re.search(r'RESOLUTION=(\d+x\d+)', line)
-                    if res_match:
-                        res = res_match.group(1)
-                    if i + 1 < len(lines) and not lines[i + 1].startswith('#'):
-                        variant_url = urllib.parse.urljoin(m3u8_url, lines[i + 1].strip())
-                        all_variants.append({"bandwidth": bw, "resolution": res, "url": variant_url})
-
+        model = playlist.parse(m3u8_content, m3u8_url)
+        _m3u8_models.set(m3u8_url, model)
+        if model.is_master:
+            all_variants = [{"bandwidth": v.bandwidth, "resolution": v.resolution, "url": v.url}
+                            for v in model.variants]
             if all_variants:
                 all_variants.sort(key=lambda x: x["bandwidth"], reverse=True)
                 settings = _load_settings()
@@ -1862,9 +3525,12 @@ def _parse_video_cards(soup, base_url):
 
 
 def _extract_related_videos(url: str):
-    """비디오 페이지에서 관련(추천) 영상 목록을 추출합니다."""
+    """비디오 페이지에서 관련(추천) 영상 목록을 추출합니다. (디스크 캐시 우선)"""
+    cached = _related_disk_get(url)
+    if cached is not None:
+        return cached
     try:
-        html, session, method = _fetch_page_with_cf_bypass(url)
+        html, _, method = _fetch_page_with_cf_bypass(url)
         soup = BeautifulSoup(html, 'html.parser')
         parsed = urllib.parse.urlparse(url)
         base_url = f"{parsed.scheme}://{parsed.netloc}"
@@ -1876,6 +3542,8 @@ def _extract_related_videos(url: str):
         related = [c for c in all_cards if _url_id(c['url']) != uid]
 
         print(f"[관련 영상] {url[:60]}... → {len(related)}개 발견")
+        if related:
+            _related_disk_put(url, related)
         return related
     except Exception as e:
         print(f"[관련 영상] 추출 실패: {e}")
@@ -1920,7 +3588,7 @@ def api_search():
         search_url += '?' + '&'.join(params)
 
     try:
-        html, session, method = _fetch_page_with_cf_bypass(search_url)
+        html, _, method = _fetch_page_with_cf_bypass(search_url)
         soup = BeautifulSoup(html, 'html.parser')
         results = _parse_video_cards(soup, base)
 
@@ -2076,10 +3744,49 @@ def open_search_window():
 # ──────────────────────────────────────────────
 # API - 대기열 관리
 # ──────────────────────────────────────────────
+_QUEUE_WAIT_MAX = 30.0   # long-poll 최대 대기(초)
+_QUEUE_PAGE_MAX = 1000   # 페이지당 최대 항목 수
+
 @app.route("/api/queue", methods=["GET"])
 def get_queue():
-    data = _load_data()
-    return jsonify(data["queue"])
+    """파라미터 없이는 전체 목록(X-Queue-Rev 헤더 포함).
+    ?fields=id,title,... → 지정한 필드만 (모든 형태에 적용)
+    ?category=&q=&limit=&cursor= → 필터/페이지 {rev, items, next_cursor, total}
+    ?since=rev → 변경분 {rev, items, removed[, order]} / 로그 범위 밖이면 {rev, full, items} / 변경 없으면 304.
+    &wait=초 → 변경이 생길 때까지 최대 그만큼 대기 (long-poll)"""
+    args = request.args
+    fields = [f for f in args.get("fields", "").split(",") if f] or None
+    if fields and "id" not in fields:
+        fields.insert(0, "id")
+    since = args.get("since", type=int)
+    if since is None:
+        paged = any(k in args for k in ("category", "q", "limit", "cursor"))
+        limit = args.get("limit", type=int)
+        limit = max(1, min(limit, _QUEUE_PAGE_MAX)) if limit else None
+        try:
+            with _data_lock:
+                rev = _queue_rev
+                items, next_cursor, total = _queue_page(fields, args.get("category"), args.get("q"),
+                                                        args.get("cursor"), limit)
+        except ValueError:
+            return jsonify({"error": "잘못된 cursor입니다."}), 400
+        if paged:
+            resp = jsonify({"rev": rev, "items": items, "next_cursor": next_cursor, "total": total})
+        else:
+            resp = jsonify(items)
+        resp.headers["X-Queue-Rev"] = str(rev)
+        return resp
+    wait = min(args.get("wait", 0, type=float), _QUEUE_WAIT_MAX)
+    if wait > 0:
+        with _queue_changed:
+            _queue_changed.wait_for(lambda: _queue_rev != since, timeout=wait)
+    if _queue_rev == since:
+        return "", 304, {"X-Queue-Rev": str(since)}
+    delta = _queue_delta(since, fields)
+    if delta is None:
+        with _data_lock:
+            delta = {"rev": _queue_rev, "full": True, "items": _queue_page(fields)[0]}
+    return jsonify(delta)
 
 @app.route("/api/queue", methods=["POST"])
 def add_to_queue():
@@ -2107,32 +3814,23 @@ def add_to_queue():
         "variants": info.get("_variants", []),
     }
 
-    data = _load_data()
     # 중복 방지
-    if any(item["id"] == uid for item in data["queue"]):
+    if not _queue_add(entry):
         return jsonify({"error": "이미 대기열에 있습니다.", "duplicate": True, "title": entry["title"]}), 409
-    data["queue"].append(entry)
-    _save_data(data)
+    if not entry["stream_url"]:
+        _preextract_enqueue([(uid, url)], _PRE_PRIO_NEW)
 
     return jsonify(entry)
 
 @app.route("/api/queue/<item_id>", methods=["DELETE"])
 def delete_from_queue(item_id):
-    data = _load_data()
-    data["queue"] = [item for item in data["queue"] if item["id"] != item_id]
     # 관련 재생 위치, 히트맵도 삭제
-    data["playback"].pop(item_id, None)
-    data["heatmaps"].pop(item_id, None)
-    _save_data(data)
+    _queue_remove([item_id])
     return jsonify({"ok": True})
 
 @app.route("/api/queue/clear", methods=["POST"])
 def clear_queue():
-    data = _load_data()
-    data["queue"] = []
-    data["playback"] = {}
-    data["heatmaps"] = {}
-    _save_data(data)
+    _queue_clear()
     return jsonify({"ok": True})
 
 @app.route("/api/queue/reorder", methods=["POST"])
@@ -2142,18 +3840,8 @@ def reorder_queue():
     id_order = body.get("ids", [])
     if not id_order:
         return jsonify({"error": "ids 필수"}), 400
-    data = _load_data()
-    id_map = {item["id"]: item for item in data["queue"]}
-    new_queue = []
-    for uid in id_order:
-        if uid in id_map:
-            new_queue.append(id_map[uid])
     # id_order에 없는 기존 항목도 유지
-    for item in data["queue"]:
-        if item["id"] not in id_order:
-            new_queue.append(item)
-    data["queue"] = new_queue
-    _save_data(data)
+    _queue_reorder(id_order)
     return jsonify({"ok": True})
 
 @app.route("/api/queue/move", methods=["POST"])
@@ -2164,15 +3852,7 @@ def move_queue_items():
     position = body.get("position", "top")  # "top" or "bottom"
     if not item_ids:
         return jsonify({"error": "ids 필수"}), 400
-    data = _load_data()
-    id_set = set(item_ids)
-    moved = [item for item in data["queue"] if item["id"] in id_set]
-    rest = [item for item in data["queue"] if item["id"] not in id_set]
-    if position == "top":
-        data["queue"] = moved + rest
-    else:
-        data["queue"] = rest + moved
-    _save_data(data)
+    _queue_move(item_ids, position)
     return jsonify({"ok": True})
 
 @app.route("/api/queue/bulk-delete", methods=["POST"])
@@ -2182,13 +3862,7 @@ def bulk_delete_queue():
     item_ids = body.get("ids", [])
     if not item_ids:
         return jsonify({"error": "ids 필수"}), 400
-    data = _load_data()
-    id_set = set(item_ids)
-    data["queue"] = [item for item in data["queue"] if item["id"] not in id_set]
-    for uid in item_ids:
-        data["playback"].pop(uid, None)
-        data["heatmaps"].pop(uid, None)
-    _save_data(data)
+    _queue_remove(item_ids)
     return jsonify({"ok": True})
 
 @app.route("/api/queue/bulk-category", methods=["POST"])
@@ -2199,15 +3873,7 @@ def bulk_set_category():
     category = body.get("category", None)
     if not item_ids:
         return jsonify({"error": "ids 필수"}), 400
-    data = _load_data()
-    id_set = set(item_ids)
-    for item in data["queue"]:
-        if item["id"] in id_set:
-            if category:
-                item["category"] = category
-            else:
-                item.pop("category", None)
-    _save_data(data)
+    _queue_set_category(item_ids, category)
     return jsonify({"ok": True})
 
 # ──────────────────────────────────────────────
@@ -2216,8 +3882,7 @@ def bulk_set_category():
 @app.route("/api/categories", methods=["GET"])
 def get_categories():
     """카테고리 목록 조회"""
-    data = _load_data()
-    return jsonify(data.get("categories", []))
+    return jsonify(_categories_list())
 
 @app.route("/api/categories", methods=["POST"])
 def create_category():
@@ -2229,36 +3894,28 @@ def create_category():
     color = body.get("color", "#4a9eff")
     cat_id = "cat_" + hashlib.md5(f"{name}{time.time()}".encode()).hexdigest()[:8]
     cat = {"id": cat_id, "name": name, "color": color}
-    data = _load_data()
-    data.setdefault("categories", []).append(cat)
-    _save_data(data)
+    _category_add(cat)
     return jsonify(cat)
 
 @app.route("/api/categories/<cat_id>", methods=["PUT"])
 def update_category(cat_id):
     """카테고리 수정 (이름/색상)"""
     body = request.json
-    data = _load_data()
-    for cat in data.get("categories", []):
-        if cat["id"] == cat_id:
-            if "name" in body:
-                cat["name"] = body["name"].strip()
-            if "color" in body:
-                cat["color"] = body["color"]
-            _save_data(data)
-            return jsonify(cat)
+    fields = {}
+    if "name" in body:
+        fields["name"] = body["name"].strip()
+    if "color" in body:
+        fields["color"] = body["color"]
+    cat = _category_update(cat_id, **fields)
+    if cat:
+        return jsonify(cat)
     return jsonify({"error": "카테고리를 찾을 수 없습니다."}), 404
 
 @app.route("/api/categories/<cat_id>", methods=["DELETE"])
 def delete_category(cat_id):
     """카테고리 삭제 (항목은 미분류로)"""
-    data = _load_data()
-    data["categories"] = [c for c in data.get("categories", []) if c["id"] != cat_id]
     # 해당 카테고리의 항목들을 미분류로
-    for item in data["queue"]:
-        if item.get("category") == cat_id:
-            item.pop("category", None)
-    _save_data(data)
+    _category_delete(cat_id)
     return jsonify({"ok": True})
 
 @app.route("/api/categories/reorder", methods=["POST"])
@@ -2268,14 +3925,7 @@ def reorder_categories():
     id_order = body.get("ids", [])
     if not id_order:
         return jsonify({"error": "ids 필수"}), 400
-    data = _load_data()
-    id_map = {c["id"]: c for c in data.get("categories", [])}
-    new_cats = [id_map[cid] for cid in id_order if cid in id_map]
-    for c in data.get("categories", []):
-        if c["id"] not in id_order:
-            new_cats.append(c)
-    data["categories"] = new_cats
-    _save_data(data)
+    _categories_reorder(id_order)
     return jsonify({"ok": True})
 
 @app.route("/api/queue/<item_id>/category", methods=["POST"])
@@ -2283,37 +3933,29 @@ def set_item_category(item_id):
     """대기열 항목의 카테고리 설정"""
     body = request.json
     category = body.get("category")  # None이면 미분류
-    data = _load_data()
-    for item in data["queue"]:
-        if item["id"] == item_id:
-            if category:
-                item["category"] = category
-            else:
-                item.pop("category", None)
-            _save_data(data)
-            return jsonify({"ok": True, "category": category})
+    if _queue_set_category([item_id], category):
+        return jsonify({"ok": True, "category": category})
     return jsonify({"error": "항목을 찾을 수 없습니다."}), 404
 
 # ──────────────────────────────────────────────
 # API - 재생 위치 기억
 # ──────────────────────────────────────────────
+@app.route("/api/playback", methods=["GET"])
+def get_playback_bulk():
+    """대기열 이어보기 배지용 일괄 조회. ?ids=a,b,c (생략 시 전체) → {"positions": {id: 초}}"""
+    ids = request.args.get("ids")
+    ids = [i for i in ids.split(",") if i] if ids else None
+    return jsonify({"positions": _playback_positions(ids)})
+
 @app.route("/api/playback/<item_id>", methods=["GET"])
 def get_playback(item_id):
-    data = _load_data()
-    pb = data.get("playback", {}).get(item_id, {"position": 0})
+    pb = _playback_get(item_id) or {"position": 0}
     return jsonify(pb)
 
 @app.route("/api/playback/<item_id>", methods=["POST"])
 def save_playback(item_id):
     body = request.json
-    data = _load_data()
-    if "playback" not in data:
-        data["playback"] = {}
-    data["playback"][item_id] = {
-        "position": body.get("position", 0),
-        "updated_at": time.time(),
-    }
-    _save_data(data)
+    _playback_set(item_id, body.get("position", 0))
     return jsonify({"ok": True})
 
 # ──────────────────────────────────────────────
@@ -2321,31 +3963,52 @@ def save_playback(item_id):
 # ──────────────────────────────────────────────
 @app.route("/api/heatmap/<item_id>", methods=["GET"])
 def get_heatmap(item_id):
-    data = _load_data()
-    hm = data.get("heatmaps", {}).get(item_id, {})
-    return jsonify(hm)
+    """?buckets=N[&duration=초] 이면 진행바 해상도로 다운샘플링한 값만 반환합니다."""
+    buckets = request.args.get("buckets", type=int)
+    if not buckets:
+        return jsonify(_heatmap_get(item_id))
+    values, width = _heatmap_buckets(item_id, min(buckets, 2000),
+                                     request.args.get("duration", type=float))
+    return jsonify({"buckets": values, "bucket_sec": width})
 
 @app.route("/api/heatmap/<item_id>", methods=["POST"])
 def save_heatmap(item_id):
     """재생 중 현재 위치(초 단위)를 기록하여 히트맵을 구축합니다."""
     body = request.json
     second = int(body.get("second", 0))
-    data = _load_data()
-    if "heatmaps" not in data:
-        data["heatmaps"] = {}
-    if item_id not in data["heatmaps"]:
-        data["heatmaps"][item_id] = {}
-    key = str(second)
-    data["heatmaps"][item_id][key] = data["heatmaps"][item_id].get(key, 0) + 1
-    _save_data(data)
+    _heatmap_add(item_id, second)
     return jsonify({"ok": True})
 
+_HEATMAP_BATCH_MAX = 20000  # 한 요청에서 받는 최대 틱 수
+
+@app.route("/api/heatmap/<item_id>/batch", methods=["POST"])
+def save_heatmap_batch(item_id):
+    """클라이언트가 모아 둔 틱을 한 번에 기록합니다.
+    {"seconds": [12, 14, ...], "ranges": [[시작, 끝], ...]} — 범위는 끝 포함, 초마다 1회"""
+    body = request.get_json(force=True, silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "본문은 {\"seconds\": [...], \"ranges\": [...]} 형식이어야 합니다."}), 400
+    try:
+        raw_seconds = body.get("seconds", [])
+        spans = [(max(int(start), 0), int(end)) for start, end in body.get("ranges", [])]
+        # 펼치기 전에 전체 틱 수를 먼저 세서 큰 요청은 메모리를 쓰기 전에 거절
+        total = len(raw_seconds) + sum(max(0, end - start + 1) for start, end in spans)
+        if total > _HEATMAP_BATCH_MAX:
+            return jsonify({"error": f"한 번에 최대 {_HEATMAP_BATCH_MAX}개까지 기록할 수 있습니다."}), 400
+        seconds = [int(sec) for sec in raw_seconds]
+        for start, end in spans:
+            seconds.extend(range(start, end + 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "seconds/ranges 형식이 올바르지 않습니다."}), 400
+    return jsonify({"ok": True, "recorded": _heatmap_add_batch(item_id, seconds)})
+
 # ──────────────────────────────────────────────
 # API - 영상 스트림 프록시
 # ──────────────────────────────────────────────
 @app.route("/api/stream")
 def stream_video():
     """yt-dlp로 추출한 직접 URL을 프록시하여 브라우저에 전달합니다."""
+    global _last_streamed_uid
     url = request.args.get("url", "")
     if not url:
         return "URL required", 400
@@ -2357,10 +4020,12 @@ def stream_video():
     try:
         # 대기열에 저장된 stream_url이 있으면 즉시 사용 (재추출 불필요)
         uid = _url_id(url)
-        data = _load_data()
-        queue_item = next((q for q in data["queue"] if q["id"] == uid), None)
+        queue_item = _queue_find(uid)
         stored_stream_url = queue_item.get("stream_url", "") if queue_item else ""
         stored_headers = queue_item.get("http_headers", {}) if queue_item else {}
+        if queue_item:
+            _last_streamed_uid = uid
+            _preextract_focus(uid)   # 다음 항목들 미리 추출
 
         t1 = time.time()
         print(f"[스트림 진단] 데이터 로드: {t1-t0:.2f}초 | stored_url={'있음' if stored_stream_url else '없음'}")
@@ -2385,10 +4050,8 @@ def stream_video():
             http_headers = info.get("http_headers", {})
             # 대기열에 stream_url 저장 (다음번 즉시 사용)
             if queue_item and video_url:
-                queue_item["stream_url"] = video_url
-                queue_item["http_headers"] = http_headers
-                queue_item["_extracted_at"] = time.time()
-                _save_data(data)
+                _queue_update(uid, stream_url=video_url, http_headers=http_headers,
+                              _extracted_at=time.time())
     except Exception as e:
         print(f"[스트림 진단] ❌ 추출 오류: {time.time()-t0:.2f}초 | {e}")
         return f"추출 오류: {e}", 500
@@ -2405,6 +4068,8 @@ def stream_video():
     if '.m3u8' in video_url:
         try:
             content = _fetch_and_cache_m3u8(video_url, headers)
+            if queue_item:
+                _hot_prefetch_start(uid, video_url, headers)
             t3 = time.time()
             print(f"[스트림 진단] ✅ M3U8 반환: {t3-t0:.2f}초 (m3u8 fetch: {t3-t2:.2f}초) | {len(content)} bytes")
             print(f"{'='*60}")
@@ -2419,19 +4084,21 @@ def stream_video():
             print(f"[스트림 진단] ⚠️ M3U8 로드 실패: {t_err-t0:.2f}초 | {e}")
             # URL 만료 등으로 실패 → 재추출 시도
             if stored_stream_url:
+                _stream_expiry_observe(stored_stream_url, queue_item.get("_extracted_at"))
                 print(f"[스트림] M3U8 로드 실패 ({e}), 재추출...")
                 try:
                     info = _extract_info(url, use_cache=False)
                     new_url = info.get("url", "")
                     if new_url:
                         if queue_item:
-                            queue_item["stream_url"] = new_url
-                            queue_item["http_headers"] = info.get("http_headers", {})
-                            queue_item["_extracted_at"] = time.time()
-                            _save_data(data)
+                            _queue_update(uid, stream_url=new_url,
+                                          http_headers=info.get("http_headers", {}),
+                                          _extracted_at=time.time())
                         new_headers = {'User-Agent': USER_AGENT}
                         new_headers.update(info.get("http_headers", {}))
                         content = _fetch_and_cache_m3u8(new_url, new_headers)
+                        if queue_item:
+                            _hot_prefetch_start(uid, new_url, new_headers)
                         response_headers = {
                             'Access-Control-Allow-Origin': '*',
                             'Content-Type': 'application/vnd.apple.mpegurl',
@@ -2448,7 +4115,7 @@ def stream_video():
         headers["Range"] = range_header
 
     try:
-        resp = requests.get(video_url, headers=headers, stream=True, timeout=30)
+        resp = _upstream_get(video_url, headers=headers, stream=True, timeout=30)
         excluded = {"content-encoding", "transfer-encoding", "connection"}
         response_headers = {
             k: v for k, v in resp.headers.items() if k.lower() not in excluded
@@ -2456,7 +4123,7 @@ def stream_video():
         response_headers["Access-Control-Allow-Origin"] = "*"
 
         return Response(
-            stream_with_context(resp.iter_content(chunk_size=1024 * 64)),
+            stream_with_context(_stream_body(resp, 1024 * 64)),
             status=resp.status_code,
             headers=response_headers,
             content_type=resp.headers.get("Content-Type", "video/mp4"),
@@ -2466,25 +4133,404 @@ def stream_video():
 
 
 # ──────────────────────────────────────────────
-# API - HLS 세그먼트 프록시
+# HLS 세그먼트 표 + 디스크 캐시
+# 세그먼트는 "참조" {"url", "key", "headers"}로 다룹니다. (_segment_ref)
+#   - 압축 경로 /api/ts-proxy/<playlist 키>/<번호>.ts → 세그먼트 표에서 O(1) 조회, 캐시 키 = (playlist 키, 번호)
+#   - 전체 경로 /api/ts-proxy/s.ts?url=... → 캐시 키 = 호스트 + 경로 + 쿼리에서 만료/서명 토큰을 뺀 것
+#   어느 쪽이든 stream_url 토큰이 갱신돼도 같은 키로 적중합니다.
+# ts-proxy로 받은 세그먼트를 segment_cache/에 저장해 되감기/재시청/구간 다운로드 때 CDN 대신 디스크에서 보냅니다.
+# 용량은 설정 segmentCacheMB (0이면 끔, 처음 사용할 때 읽음). 넘으면 오래 안 쓴 파일부터 삭제(LRU, 순서는 파일 mtime으로 보존).
 # ──────────────────────────────────────────────
-@app.route("/api/ts-proxy")
-@app.route("/api/ts-proxy/s.ts")
-def ts_proxy():
-    """HLS 세그먼트(.ts)와 서브 m3u8를 프록시합니다.
-    올바른 CDN 헤더(Referer 등)를 주입하여 지연 없이 전송합니다."""
-    seg_url = request.args.get("url", "")
-    if not seg_url:
-        return "URL required", 400
+_SEGMENT_MAX_BYTES = 64 * 1024 * 1024   # 이보다 큰 응답은 캐시하지 않음
+_SEGMENT_VOLATILE_PARAMS = {
+    "expires", "expire", "token", "sig", "signature", "hash", "hmac",
+    "policy", "key-pair-id", "hdnts", "hdntl", "auth", "auth_key", "validfrom", "validto",
+}   # + _EPOCH_PARAMS(e, t, st, exp)는 값이 epoch 시각일 때만
+_SEGMENT_TYPES = {
+    ".ts": "video/mp2t", ".m4s": "video/iso.segment", ".mp4": "video/mp4",
+    ".aac": "audio/aac", ".key": "application/octet-stream",
+}
+_COMPACT_PATH_RE = re.compile(r'^(?:https?://[^/]+)?/api/ts-proxy/([0-9a-f]+)/(\d+)\.\w+$')
+_segment_cache_lock = threading.Lock()
+_segment_cache = None   # BoundedCache: 키 해시 -> {"path", "size"}, 꺼져 있으면 False
+
+# playlist 키 -> {"urls": [원래 URL...], "headers": 요청 헤더} (재작성 때 생성, 토큰 갱신 시 같은 키로 교체)
+_segment_tables = BoundedCache("segment_tables", max_entries=300, max_bytes=64 * 1024 * 1024,
+                               sizeof=lambda t: 200 + sum(len(u) + 60 for u in t["urls"]))
+# playlist 키 -> (playlist URL, 헤더): 표가 밀려난 뒤 요청이 오면 playlist를 다시 받아 표를 복구
+_segment_table_sources = BoundedCache("segment_table_sources", max_entries=2000)
+
+def _segment_table_put(pkey, playlist_url, urls, headers):
+    _segment_tables.set(pkey, {"urls": urls, "headers": headers})
+    _segment_table_sources.set(pkey, (playlist_url, headers))
+
+def _segment_table_ref(pkey, index):
+    """(playlist 키, 번호) → 세그먼트 참조. 표가 없으면 원래 playlist를 다시 받아 복구를 시도합니다."""
+    table = _segment_tables.get(pkey)
+    if table is None:
+        source = _segment_table_sources.get(pkey)
+        if source is None:
+            return None
+        try:
+            _single_flight("m3u8", source[0], lambda: _load_m3u8(*source))
+        except Exception as e:
+            print(f"[세그먼트 표] {pkey} 복구 실패: {e}")
+            return None
+        table = _segment_tables.get(pkey)
+    if table is None or not 0 <= index < len(table["urls"]):
+        return None
+    return {"url": table["urls"][index], "headers": table["headers"],
+            "key": hashlib.sha1(f"{pkey}/{index}".encode()).hexdigest()}
+
+def _playlist_key(playlist_url):
+    """압축 경로의 playlist 키. 만료/서명 토큰을 뺀 URL 기준이라 토큰이 갱신돼도 같습니다."""
+    return _segment_cache_key(playlist_url)[:16]
+
+def _model_ref(model, item):
+    """파싱된 playlist의 세그먼트/화질 → 세그먼트 참조. 압축 경로 playlist면 ts-proxy와 같은 (키, 번호) 캐시 키."""
+    if model.fixed:
+        ref = _segment_table_ref(_playlist_key(model.url), item.index)
+        if ref is not None:
+            return ref
+    return {"url": item.url, "key": _segment_cache_key(item.url), "headers": _segment_request_headers(item.url)}
+
+def _segment_ref(target):
+    """프록시 경로(압축/전체) 또는 CDN URL → 세그먼트 참조 {"url", "key", "headers"}. 찾을 수 없으면 None."""
+    m = _COMPACT_PATH_RE.match(target)
+    if m:
+        return _segment_table_ref(m.group(1), int(m.group(2)))
+    if target.startswith(playlist.PROXY_PREFIX):
+        values = urllib.parse.parse_qs(target[target.index('?') + 1:]).get('url')
+        if not values:
+            return None
+        target = values[0]
+    return {"url": target, "key": _segment_cache_key(target), "headers": _segment_request_headers(target)}
 
+def _segment_volatile(name, value):
+    name = name.lower()
+    if name in _EPOCH_PARAMS:
+        return _epoch_value(value) is not None
+    return name in _SEGMENT_VOLATILE_PARAMS or name.startswith("x-amz-")
+
+def _segment_cache_key(seg_url):
+    """만료/서명 토큰을 뺀 세그먼트 식별 키의 해시."""
     parsed = urllib.parse.urlparse(seg_url)
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+                   if not _segment_volatile(k, v))
+    path = "/".join(part for part in parsed.path.split("/") if "=" not in part)  # 경로 토큰(exp=..~hmac=..) 제외
+    key = f"{parsed.netloc}{path}?{urllib.parse.urlencode(query)}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def _segment_ext(seg_url):
+    ext = os.path.splitext(urllib.parse.urlparse(seg_url).path)[1].lower()
+    return ext if ext in _SEGMENT_TYPES else ".bin"
+
+def _segment_file_evicted(key, entry):
+    try:
+        os.remove(entry["path"])
+    except OSError:
+        pass
+
+def _segments():
+    """세그먼트 캐시 인덱스. 처음 쓸 때 폴더를 훑어 오래된 순서로 올립니다. 꺼져 있으면 None."""
+    global _segment_cache
+    with _segment_cache_lock:
+        if _segment_cache is None:
+            budget = int(_load_settings().get("segmentCacheMB", 1024)) * 1024 * 1024
+            if budget <= 0:
+                _segment_cache = False
+                return None
+            SEGMENT_CACHE_DIR.mkdir(exist_ok=True)
+            cache = BoundedCache("segments", max_entries=200000, max_bytes=budget,
+                                 sizeof=lambda entry: entry["size"], on_evict=_segment_file_evicted)
+            files = []
+            for entry in os.scandir(SEGMENT_CACHE_DIR):
+                if entry.name.endswith(".part"):
+                    os.remove(entry.path)       # 중단된 쓰기
+                elif entry.is_file():
+                    st = entry.stat()
+                    files.append((st.st_mtime, entry.name.split(".")[0], entry.path, st.st_size))
+            for _, key, path, size in sorted(files):
+                cache.set(key, {"path": path, "size": size})
+            if files:
+                print(f"[세그먼트 캐시] {len(cache)}개 ({cache.stats()['bytes'] / 1024 / 1024:.0f}MB) 로드")
+            _segment_cache = cache
+        return _segment_cache if _segment_cache is not False else None
+
+def _segment_cache_get(ref):
+    """캐시된 세그먼트 항목 {"path", "size"}. 없으면 None."""
+    cache = _segments()
+    if cache is None:
+        return None
+    key = ref["key"]
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    try:
+        os.utime(entry["path"])     # LRU 순서 보존 (재시작 시 mtime 순으로 로드)
+    except OSError:
+        cache.pop(key)
+        return None
+    return entry
+
+def _segment_cache_put(ref, chunks):
+    """chunks(바이트 조각 iterable)를 캐시 파일에 쓰면서 그대로 다시 내보냅니다.
+    끝까지 다 받았을 때만 캐시에 등록합니다. (클라이언트 중단/오류/너무 큰 응답은 버림)"""
+    cache = _segments()
+    if cache is None:
+        yield from chunks
+        return
+    key = ref["key"]
+    final = SEGMENT_CACHE_DIR / (key + _segment_ext(ref["url"]))
+    tmp = final.with_name(f"{final.name}.{threading.get_ident()}.part")
+    f = open(tmp, "wb")
+    written = 0
+    complete = False
+    try:
+        for block in chunks:
+            written += len(block)
+            if f and written > _SEGMENT_MAX_BYTES:
+                f.close()
+                f = None
+            if f:
+                f.write(block)
+            yield block
+        complete = True
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()         # 클라이언트가 끊었을 때 업스트림 응답도 정리
+        if f:
+            f.close()
+        if f and complete and written:
+            os.replace(tmp, final)
+            cache.set(key, {"path": str(final), "size": written})
+        else:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
 
+def _segment_request_headers(seg_url):
+    """세그먼트 요청 헤더: UA + M3U8 로드 때 저장한 CDN 헤더 (없으면 같은 호스트 Referer)."""
+    parsed = urllib.parse.urlparse(seg_url)
     headers = {'User-Agent': USER_AGENT}
-    cached_hdrs = _segment_headers_cache.get(parsed.netloc, {})
-    headers.update(cached_hdrs)
+    headers.update(_segment_headers_cache.get(parsed.netloc, {}))
     if 'Referer' not in headers and 'referer' not in headers:
         headers['Referer'] = f'{parsed.scheme}://{parsed.netloc}/'
+    return headers
+
+def _segment_cached(ref):
+    cache = _segments()
+    return cache is not None and ref["key"] in cache
+
+def _segment_prefetch(ref):
+    """세그먼트 하나를 디스크 캐시에 받아 둡니다. 새로 받았으면 True."""
+    if _segments() is None or _segment_cached(ref):
+        return False
+    resp = _upstream_get(ref["url"], headers=ref["headers"], stream=True, timeout=20)
+    if resp.status_code != 200:
+        resp.close()
+        return False
+    for _ in _segment_cache_put(ref, _stream_body(resp, 1024 * 128)):
+        pass
+    return _segment_cached(ref)
+
+def _segment_bytes(ref, range_header=None, timeout=30):
+    """세그먼트 내용 전체. 디스크 캐시에 있으면 파일에서, 없으면 CDN에서 받으며 캐시에도 씁니다.
+    (range_header가 있는 부분 요청은 캐시하지 않음)"""
+    if not range_header:
+        cached = _segment_cache_get(ref)
+        if cached:
+            try:
+                return Path(cached["path"]).read_bytes()
+            except OSError:
+                pass
+    headers = dict(ref["headers"])
+    if range_header:
+        headers["Range"] = range_header
+    resp = _upstream_get(ref["url"], headers=headers, stream=True, timeout=timeout)
+    if resp.status_code >= 400:
+        resp.close()
+        resp.raise_for_status()
+    body = _stream_body(resp, 1024 * 128)
+    if resp.status_code == 200 and not range_header:
+        body = _segment_cache_put(ref, body)
+    return b"".join(body)
+
+# ──────────────────────────────────────────────
+# 히트맵 기반 세그먼트 미리 받기
+# 대기열 항목 재생이 시작되면, 캐시된 M3U8의 EXTINF 타임라인과 히트맵을 맞춰 가장 많이 본 구간의
+# 세그먼트를 백그라운드에서 디스크 캐시에 받아 둡니다. → 자주 보는 지점으로 이동하면 바로 재생
+# ──────────────────────────────────────────────
+_HOT_PREFETCH_SEGMENTS = 12    # 항목당 미리 받을 최대 세그먼트 수
+_HOT_PREFETCH_DELAY = 5        # 재생 시작 후 대기(초): 플레이어가 화질을 고르고 첫 세그먼트를 받을 시간
+_HOT_PREFETCH_REPEAT = 600     # 같은 항목을 다시 훑기 전 최소 간격(초)
+_hot_prefetch_lock = threading.Lock()
+_hot_prefetch_last = {}        # uid -> 마지막 시작 시각
+
+def _media_playlist(video_url, headers, max_bandwidth=None):
+    """재생 중인 화질의 media playlist 모델. master면 플레이어가 이미 받은 화질,
+    없으면 max_bandwidth 이하 중 최고 화질 (없거나 지정 안 하면 최고 화질)."""
+    model = _m3u8_model(video_url, headers)
+    if model is None or not model.is_master:
+        return model
+    variants = sorted(model.variants, key=lambda v: v.bandwidth, reverse=True)
+    chosen = next((v for v in variants if v.url in _m3u8_content_cache), None)
+    if chosen is None:
+        fitting = [v for v in variants if max_bandwidth and v.bandwidth <= max_bandwidth]
+        chosen = (fitting or variants)[0]
+    ref = _model_ref(model, chosen)
+    return _m3u8_model(ref["url"], ref["headers"])
+
+def _hot_segments(uid, model, limit):
+    """세그먼트별 초당 평균 시청 횟수가 높은 순으로 최대 limit개의 세그먼트 참조."""
+    with _data_lock:
+        arr = _store["heatmaps"].get(uid)
+        arr = array("I", arr) if arr else None
+    if not arr or model is None:
+        return []
+    scored = []
+    for seg in model.segments:
+        if seg.byterange:
+            continue    # 부분 요청 세그먼트는 디스크 캐시 대상이 아님
+        lo = int(seg.start)
+        hi = max(lo + 1, int(seg.end + 0.5))
+        score = sum(arr[lo:hi]) / (hi - lo)
+        if score > 0:
+            scored.append((score, seg))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [_model_ref(model, seg) for _, seg in scored[:limit]]
+
+def _hot_prefetch_start(uid, video_url, headers):
+    """재생 시작 시 호출. 같은 항목은 _HOT_PREFETCH_REPEAT 안에 한 번만 실행합니다."""
+    if _segments() is None:
+        return
+    now = time.time()
+    with _hot_prefetch_lock:
+        if now - _hot_prefetch_last.get(uid, 0) < _HOT_PREFETCH_REPEAT:
+            return
+        _hot_prefetch_last[uid] = now
+        if len(_hot_prefetch_last) > 500:
+            for k in [k for k, t in _hot_prefetch_last.items() if now - t >= _HOT_PREFETCH_REPEAT]:
+                del _hot_prefetch_last[k]
+    threading.Thread(target=_hot_prefetch_run, args=(uid, video_url, dict(headers)),
+                     daemon=True, name="HotPrefetch").start()
+
+def _hot_prefetch_run(uid, video_url, headers):
+    time.sleep(_HOT_PREFETCH_DELAY)
+    try:
+        hot = _hot_segments(uid, _media_playlist(video_url, headers), _HOT_PREFETCH_SEGMENTS)
+        if not hot:
+            return
+        fetched = sum(1 for ref in hot if _segment_prefetch(ref))
+        print(f"[히트맵 프리패치] {uid}: 인기 구간 세그먼트 {len(hot)}개 중 {fetched}개 새로 받음")
+    except Exception as e:
+        print(f"[히트맵 프리패치] {uid} 실패: {e}")
+
+# ──────────────────────────────────────────────
+# 다음 항목 예열 (autoplayNext)
+# 현재 영상이 끝나기 60초 전에 프론트엔드가 다음 항목으로 호출합니다. 백그라운드에서
+# stream_url 만료 확인/갱신 → master/media playlist 로드 → 이어볼 위치부터 첫 세그먼트 몇 개를 디스크 캐시에.
+# ──────────────────────────────────────────────
+_WARMUP_SEGMENTS = 3           # 미리 받을 세그먼트 수
+_WARMUP_BANDWIDTH = 5000000    # 첫 화질 추정 (app.js hls.js abrEwmaDefaultEstimate와 맞춤)
+_WARMUP_REPEAT = 300           # 같은 항목 재예열 최소 간격(초)
+_warmup_lock = threading.Lock()
+_warmup_last = {}              # uid -> 마지막 예열 시각
+
+def _warmup_start(uid):
+    """예열 스레드를 시작합니다. 최근에 예열했으면 False."""
+    now = time.time()
+    with _warmup_lock:
+        if now - _warmup_last.get(uid, 0) < _WARMUP_REPEAT:
+            return False
+        for k in [k for k, t in _warmup_last.items() if now - t >= _WARMUP_REPEAT]:
+            del _warmup_last[k]
+        _warmup_last[uid] = now
+    threading.Thread(target=_warmup_run, args=(uid,), daemon=True, name="Warmup").start()
+    return True
+
+def _queue_stream_source(uid, item, force=False):
+    """대기열 항목의 (stream_url, 요청 헤더, 항목). stream_url이 없거나 만료 _REFRESH_LEAD_SEC 전이면
+    (force면 무조건) 다시 추출해 대기열에 반영합니다."""
+    stream_url = item.get("stream_url", "")
+    expires = _stream_expiry(stream_url, item.get("_extracted_at"))
+    if force or not stream_url or (expires and expires - time.time() < _REFRESH_LEAD_SEC):
+        fields = _preextract_one(uid, item["url"], refresh=bool(stream_url))
+        if fields:
+            _queue_update(uid, **fields)
+            stream_url = fields["stream_url"]
+            item = {**item, **fields}
+    headers = {'User-Agent': USER_AGENT}
+    headers.update(item.get("http_headers") or {})
+    return stream_url, headers, item
+
+def _warmup_run(uid):
+    t0 = time.time()
+    try:
+        item = _queue_find(uid)
+        if not item:
+            return
+        stream_url, headers, item = _queue_stream_source(uid, item)
+        if '.m3u8' not in stream_url:
+            return
+        model = _media_playlist(stream_url, headers, _WARMUP_BANDWIDTH)
+        if model is None:
+            return
+        resume = _playback_positions([uid]).get(uid, 0)
+        upcoming = [_model_ref(model, seg) for seg in model.segments_between(resume, float("inf"))
+                    if not seg.byterange][:_WARMUP_SEGMENTS]
+        fetched = sum(1 for ref in upcoming if _segment_prefetch(ref))
+        print(f"[예열] {item.get('title', uid)[:40]} — playlist 준비, 세그먼트 {fetched}/{len(upcoming)}개 ({time.time() - t0:.1f}초)")
+    except Exception as e:
+        print(f"[예열] {uid} 실패: {e}")
+
+@app.route("/api/queue/<item_id>/warmup", methods=["POST"])
+def warmup_queue_item(item_id):
+    """다음에 재생할 항목을 백그라운드에서 미리 준비합니다."""
+    if not _queue_find(item_id):
+        return jsonify({"error": "항목을 찾을 수 없습니다."}), 404
+    started = _warmup_start(item_id)
+    return jsonify({"ok": True, "started": started}), 202
 
+# ──────────────────────────────────────────────
+# API - HLS 세그먼트 프록시
+# ──────────────────────────────────────────────
+@app.route("/api/ts-proxy")
+@app.route("/api/ts-proxy/s.ts")
+def ts_proxy():
+    """HLS 세그먼트(.ts)와 서브 m3u8를 프록시합니다. (전체 URL 경로: ?url=...)"""
+    seg_url = request.args.get("url", "")
+    if not seg_url:
+        return "URL required", 400
+    ref = _segment_ref(seg_url)
+    if ref is None:
+        return "세그먼트를 찾을 수 없습니다", 404
+    return _proxy_segment(ref)
+
+@app.route("/api/ts-proxy/<pkey>/<name>")
+def ts_proxy_indexed(pkey, name):
+    """압축 경로 /api/ts-proxy/<playlist 키>/<번호>.<확장자> → 세그먼트 표에서 원래 URL을 찾아 프록시합니다."""
+    index = name.split('.', 1)[0]
+    ref = _segment_table_ref(pkey, int(index)) if index.isdigit() else None
+    if ref is None:
+        return "세그먼트를 찾을 수 없습니다", 404
+    return _proxy_segment(ref)
+
+def _proxy_segment(ref):
+    """세그먼트 참조를 프록시합니다. 올바른 CDN 헤더(Referer 등)를 주입하고,
+    디스크 캐시에 있는 세그먼트는 파일에서 바로 보냅니다. (Range 지원)"""
+    seg_url = ref["url"]
+    if '.m3u8' not in seg_url:
+        cached = _segment_cache_get(ref)
+        if cached:
+            resp = send_file(cached["path"], mimetype=_SEGMENT_TYPES.get(_segment_ext(seg_url), "video/mp2t"),
+                             conditional=True, max_age=3600)
+            resp.headers["Access-Control-Allow-Origin"] = "*"
+            return resp
+
+    headers = dict(ref["headers"])
     range_header = request.headers.get("Range")
     if range_header:
         headers["Range"] = range_header
@@ -2498,7 +4544,7 @@ def ts_proxy():
                 'Cache-Control': 'max-age=300',
             })
 
-        resp = requests.get(seg_url, headers=headers, stream=True, timeout=20)
+        resp = _upstream_get(seg_url, headers=headers, stream=True, timeout=20)
         excluded = {"content-encoding", "transfer-encoding", "connection"}
         response_headers = {
             k: v for k, v in resp.headers.items() if k.lower() not in excluded
@@ -2506,8 +4552,11 @@ def ts_proxy():
         response_headers["Access-Control-Allow-Origin"] = "*"
         response_headers["Cache-Control"] = "max-age=3600"
 
+        body = _stream_body(resp, 1024 * 128)
+        if resp.status_code == 200 and not range_header:
+            body = _segment_cache_put(ref, body)
         return Response(
-            stream_with_context(resp.iter_content(chunk_size=1024 * 128)),
+            stream_with_context(body),
             status=resp.status_code,
             headers=response_headers,
             content_type=resp.headers.get("Content-Type", "video/mp2t"),
@@ -2515,10 +4564,126 @@ def ts_proxy():
     except Exception as e:
         return f"세그먼트 프록시 오류: {e}", 502
 
+# ──────────────────────────────────────────────
+# API - 이벤트 스트림 (SSE: 다운로드/구간 다운로드 진행 상황)
+# 작업 상태가 바뀌면 _publish_event()가 직전에 보낸 상태와 달라진 필드만 모든 구독자에게 보냅니다.
+# 진행률 갱신은 작업별로 _EVENT_MIN_INTERVAL에 한 번으로 제한하고(보류된 최신 값은 나중에 전송),
+# status 변경은 즉시 보냅니다. 끝난 작업(done/error)은 _EVENT_FINISHED_TTL 동안만 snapshot에 남깁니다.
+# (재연결 중에 끝난 작업도 최종 상태를 받도록, 그 뒤로는 프로세스 수명 동안 쌓이지 않게 정리)
+# ──────────────────────────────────────────────
+_EVENT_MIN_INTERVAL = 0.5   # 작업별 진행률 이벤트 최소 간격(초)
+_EVENT_KEEPALIVE_SEC = 15   # 연결 유지용 주석 라인 간격
+_EVENT_QUEUE_MAX = 500      # 구독자별 미전송 메시지 한도 (넘으면 연결을 끊어 재동기화)
+_EVENT_TERMINAL = {"done", "error"}   # 끝난 작업 상태
+_EVENT_FINISHED_TTL = 600   # 끝난 작업 상태를 snapshot에 남겨 두는 시간(초)
+_event_lock = threading.Lock()
+_event_subscribers = set()  # {Queue}
+_event_sent = {}            # (kind, uid) -> 구독자에게 마지막으로 알린 상태
+_event_sent_at = {}         # (kind, uid) -> 마지막 전송 시각
+_event_pending = {}         # (kind, uid) -> 제한에 걸려 보류된 최신 상태
+
+def _event_broadcast(kind, payload):
+    """(_event_lock 보유 상태)"""
+    msg = f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    for sub in list(_event_subscribers):
+        try:
+            sub.put_nowait(msg)
+        except Full:
+            _event_subscribers.discard(sub)
+
+def _event_send(key, state):
+    """직전 상태와의 차이를 전송합니다. (_event_lock 보유 상태)"""
+    kind, uid = key
+    _event_pending.pop(key, None)
+    if state is None:
+        _event_sent.pop(key, None)
+        _event_sent_at.pop(key, None)
+        _event_broadcast(kind, {"id": uid, "removed": True})
+        return
+    last = _event_sent.get(key, {})
+    delta = {k: v for k, v in state.items() if k not in last or last[k] != v}
+    delta.update({k: None for k in last if k not in state})
+    if not delta:
+        return
+    _event_sent[key] = state
+    _event_sent_at[key] = time.time()
+    _event_broadcast(kind, {"id": uid, "data": delta})
+    if state.get("status") in _EVENT_TERMINAL:
+        _event_prune_finished()
+
+def _event_prune_finished():
+    """_EVENT_FINISHED_TTL이 지난 끝난 작업 상태를 버립니다. (_event_lock 보유 상태)"""
+    cutoff = time.time() - _EVENT_FINISHED_TTL
+    for key in [k for k, st in _event_sent.items()
+                if st.get("status") in _EVENT_TERMINAL and _event_sent_at.get(k, 0) < cutoff]:
+        del _event_sent[key]
+        _event_sent_at.pop(key, None)
+
+def _publish_event(kind, uid, state):
+    """작업 상태(dict, 삭제 시 None)를 구독자에게 알립니다. kind: "download" | "clip" """
+    key = (kind, uid)
+    state = dict(state) if state is not None else None
+    with _event_lock:
+        last = _event_sent.get(key)
+        if (state is None or last is None or state.get("status") != last.get("status")
+                or time.time() - _event_sent_at.get(key, 0) >= _EVENT_MIN_INTERVAL):
+            _event_send(key, state)
+        else:
+            _event_pending[key] = state
+
+def _event_flush_pending(force=False):
+    now = time.time()
+    with _event_lock:
+        for key, state in list(_event_pending.items()):
+            if force or now - _event_sent_at.get(key, 0) >= _EVENT_MIN_INTERVAL:
+                _event_send(key, state)
+
+@app.route("/api/events")
+def event_stream():
+    """SSE 구독. 연결 직후 snapshot({downloads, clips}) 1회, 이후 download/clip 이벤트
+    ({id, data: 바뀐 필드} 또는 {id, removed: true})를 받습니다."""
+    sub = Queue(maxsize=_EVENT_QUEUE_MAX)
+    _event_flush_pending(force=True)
+    with _event_lock:
+        _event_prune_finished()
+        snapshot = {"downloads": {}, "clips": {}}
+        for (kind, uid), state in _event_sent.items():
+            snapshot["downloads" if kind == "download" else "clips"][uid] = state
+        _event_subscribers.add(sub)
+
+    def generate():
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            idle = 0.0
+            while sub in _event_subscribers:
+                try:
+                    yield sub.get(timeout=_EVENT_MIN_INTERVAL)
+                    idle = 0.0
+                except Empty:
+                    _event_flush_pending()
+                    idle += _EVENT_MIN_INTERVAL
+                    if idle >= _EVENT_KEEPALIVE_SEC:
+                        idle = 0.0
+                        yield ": keepalive\n\n"
+        finally:
+            with _event_lock:
+                _event_subscribers.discard(sub)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ──────────────────────────────────────────────
 # API - 구간 다운로드 (ffmpeg로 특정 시간대 추출)
 # ──────────────────────────────────────────────
 _clip_status = {}  # uid -> {status, progress, error, filename}
+
+def _clip_set(uid, state=None, **fields):
+    """구간 다운로드 상태를 갱신(state를 주면 통째로 교체)하고 이벤트로 알립니다."""
+    if state is not None:
+        _clip_status[uid] = state
+    else:
+        _clip_status[uid].update(fields)
+    _publish_event("clip", uid, _clip_status[uid])
 _ffmpeg_path = None  # 캐시
 
 def _find_ffmpeg():
@@ -2573,7 +4738,7 @@ def clip_download():
         return jsonify({"error": "종료 시간이 시작 시간보다 커야 합니다"}), 400
 
     uid = hashlib.md5(f"{url}_{start_time}_{end_time}_{time.time()}".encode()).hexdigest()[:12]
-    _clip_status[uid] = {"status": "preparing", "progress": 0, "error": None, "filename": None}
+    _clip_set(uid, {"status": "preparing", "progress": 0, "error": None, "filename": None})
 
     threading.Thread(target=_do_clip_download, args=(uid, url, start_time, end_time, title), daemon=True).start()
     return jsonify({"id": uid, "status": "preparing"})
@@ -2586,6 +4751,36 @@ def clip_status(uid):
     return jsonify(status)
 
 
+def _clip_media_playlist(url):
+    """구간 다운로드할 media playlist 모델. 대기열 항목이면 저장된 stream_url(만료 임박 시 갱신),
+    아니면 추출 결과를 사용합니다. playlist를 못 받으면 한 번 다시 추출해 재시도합니다."""
+    queue_id = _url_id(url)
+    item = _queue_find(queue_id)
+    for retry in (False, True):
+        if item:
+            stream_url, headers, item = _queue_stream_source(queue_id, item, force=retry)
+        else:
+            info = _extract_info(url, use_cache=not retry)
+            stream_url = info.get("url", "")
+            headers = {'User-Agent': USER_AGENT}
+            headers.update(info.get("http_headers") or {})
+        if not stream_url:
+            raise ValueError("스트림 URL을 찾을 수 없습니다")
+        if '.m3u8' not in stream_url:
+            raise ValueError("HLS(m3u8) 스트림이 아니어서 구간 다운로드를 할 수 없습니다")
+        try:
+            model = _media_playlist(stream_url, headers)
+            if model is None:
+                raise ValueError("M3U8를 읽지 못했습니다")
+            return model
+        except Exception as e:
+            if retry:
+                raise
+            print(f"[구간 다운로드] M3U8 로드 실패 ({e}), 재추출...")
+            _stream_expiry_observe(stream_url, item.get("_extracted_at") if item else None)
+            _m3u8_content_cache.pop(stream_url)
+            _m3u8_models.pop(stream_url)
+
 def _do_clip_download(uid, url, start_time, end_time, title):
     """HLS 세그먼트를 직접 다운로드 후 ffmpeg로 MP4 변환"""
     try:
@@ -2607,54 +4802,29 @@ def _do_clip_download(uid, url, start_time, end_time, title):
 
         ffmpeg = _find_ffmpeg()
         if not ffmpeg:
-            _clip_status[uid] = {"status": "error", "progress": 0,
-                                 "error": "ffmpeg를 찾을 수 없습니다", "filename": None}
+            _clip_set(uid, {"status": "error", "progress": 0,
+                            "error": "ffmpeg를 찾을 수 없습니다", "filename": None})
             return
 
-        # 1) 로컬 프록시에서 M3U8 가져오기
-        _clip_status[uid]["status"] = "extracting"
+        # 1) 파싱된 media playlist (플레이어와 같은 캐시/추출 경로, 서버 내부 호출)
+        _clip_set(uid, status="extracting")
         print(f"[구간 다운로드] M3U8 가져오는 중...")
-        encoded_url = urllib.parse.quote(url, safe='')
-        m3u8_resp = requests.get(f"http://127.0.0.1:5000/api/stream?url={encoded_url}", timeout=30)
-        m3u8_resp.raise_for_status()
-        m3u8_text = m3u8_resp.text
-
-        # 2) M3U8 파싱: 세그먼트 URL + 누적 시간 계산
-        segments = []
-        cumulative_time = 0.0
-        current_duration = 0.0
-        for line in m3u8_text.split('\n'):
-            line = line.strip()
-            if line.startswith('#EXTINF:'):
-                try:
-                    current_duration = float(line.split(':')[1].split(',')[0])
-                except (ValueError, IndexError):
-                    current_duration = 5.0
-            elif line and not line.startswith('#'):
-                seg_start = cumulative_time
-                seg_end = cumulative_time + current_duration
-                # 구간과 겹치는 세그먼트만 수집
-                if seg_end > start_time and seg_start < end_time:
-                    # 상대 URL → 절대 URL
-                    if line.startswith('/'):
-                        seg_url = f"http://127.0.0.1:5000{line}"
-                    elif not line.startswith('http'):
-                        seg_url = f"http://127.0.0.1:5000/{line}"
-                    else:
-                        seg_url = line
-                    segments.append({"url": seg_url, "start": seg_start, "duration": current_duration})
-                cumulative_time = seg_end
+        model = _clip_media_playlist(url)
+
+        # 2) 누적 시작 시각에서 구간과 겹치는 세그먼트를 이진 탐색
+        segments = [{"ref": _model_ref(model, seg), "start": seg.start, "duration": seg.duration,
+                     "range": seg.range_header()}
+                    for seg in model.segments_between(start_time, end_time)]
 
         if not segments:
-            _clip_status[uid] = {"status": "error", "progress": 0,
-                                 "error": "해당 구간의 세그먼트를 찾을 수 없습니다", "filename": None}
+            _clip_set(uid, {"status": "error", "progress": 0,
+                            "error": "해당 구간의 세그먼트를 찾을 수 없습니다", "filename": None})
             return
 
         print(f"[구간 다운로드] 세그먼트 {len(segments)}개 ({segments[0]['start']:.0f}s ~ {segments[-1]['start'] + segments[-1]['duration']:.0f}s)")
 
         # 3) 세그먼트 병렬 다운로드 → 임시 .ts 파일에 순서대로 쓰기
-        _clip_status[uid]["status"] = "downloading"
-        _clip_status[uid]["detail"] = f"0/{len(segments)} 세그먼트"
+        _clip_set(uid, status="downloading", detail=f"0/{len(segments)} 세그먼트")
         tmp_ts = tempfile.NamedTemporaryFile(suffix='.ts', delete=False, dir=str(out_dir))
         tmp_ts_path = tmp_ts.name
         try:
@@ -2667,9 +4837,7 @@ def _do_clip_download(uid, url, start_time, end_time, title):
 
             def download_segment(idx_seg):
                 idx, seg = idx_seg
-                resp = requests.get(seg["url"], timeout=30)
-                resp.raise_for_status()
-                return idx, resp.content
+                return idx, _segment_bytes(seg["ref"], seg["range"])
 
             with ThreadPoolExecutor(max_workers=4) as pool:
                 futures = {pool.submit(download_segment, (i, seg)): i for i, seg in enumerate(segments)}
@@ -2681,8 +4849,8 @@ def _do_clip_download(uid, url, start_time, end_time, title):
                         downloaded_bytes += len(data)
                         dl_mb = downloaded_bytes / 1024 / 1024
                         pct = round(completed_count / len(segments) * 80)
-                        _clip_status[uid]["progress"] = pct
-                        _clip_status[uid]["detail"] = f"{completed_count}/{len(segments)} 세그먼트 ({dl_mb:.1f}MB)"
+                        _clip_set(uid, progress=pct,
+                                  detail=f"{completed_count}/{len(segments)} 세그먼트 ({dl_mb:.1f}MB)")
                     except Exception as e:
                         completed_count += 1
                         print(f"[구간 다운로드] 세그먼트 실패: {e}")
@@ -2726,17 +4894,17 @@ def _do_clip_download(uid, url, start_time, end_time, title):
 
             if proc.returncode == 0 and out_file.exists() and out_file.stat().st_size > 1000:
                 file_size = out_file.stat().st_size
-                _clip_status[uid] = {
+                _clip_set(uid, {
                     "status": "done", "progress": 100,
                     "error": None, "filename": str(out_file),
                     "size": file_size
-                }
+                })
                 print(f"[구간 다운로드] ✅ 완료: {out_file.name} ({file_size // 1024}KB)")
             else:
                 err_lines = [l for l in stderr_text.split('\n')
                              if any(w in l.lower() for w in ['error', 'fail', 'invalid'])]
                 err_msg = err_lines[-1].strip() if err_lines else f"ffmpeg 종료 코드: {proc.returncode}"
-                _clip_status[uid] = {"status": "error", "progress": 0, "error": err_msg, "filename": None}
+                _clip_set(uid, {"status": "error", "progress": 0, "error": err_msg, "filename": None})
                 print(f"[구간 다운로드] ❌ 실패: {err_msg[:200]}")
 
         finally:
@@ -2747,7 +4915,7 @@ def _do_clip_download(uid, url, start_time, end_time, title):
                 pass
 
     except Exception as e:
-        _clip_status[uid] = {"status": "error", "progress": 0, "error": str(e)[:150], "filename": None}
+        _clip_set(uid, {"status": "error", "progress": 0, "error": str(e)[:150], "filename": None})
         print(f"[구간 다운로드] ❌ 오류: {e}")
         import traceback
         traceback.print_exc()
@@ -2770,6 +4938,11 @@ _download_active = 0   # 현재 다운로드 중인 수
 _download_lock = threading.Lock()
 _MAX_CONCURRENT_DL = 1  # 1개씩 순차 다운로드 (안정성 + 속도 우선)
 
+def _download_set(uid, **fields):
+    """다운로드 상태 필드를 갱신하고 이벤트로 알립니다. (_download_lock 보유 상태)"""
+    _download_status[uid].update(fields)
+    _publish_event("download", uid, _download_status[uid])
+
 def _sanitize_filename(name: str) -> str:
     """파일명에 사용할 수 없는 문자 제거"""
     name = re.sub(r'[\\/:*?"<>|]', '_', name)
@@ -2795,7 +4968,7 @@ def _do_download_worker(dl_item):
     out_filepath = None
     try:
         with _download_lock:
-            _download_status[uid]["status"] = "downloading"
+            _download_set(uid, status="downloading")
         print(f"[다운로드] 시작: {title[:60]}")
 
         # 다운로드 폴더 설정
@@ -2808,8 +4981,7 @@ def _do_download_worker(dl_item):
         out_dir.mkdir(exist_ok=True)
 
         # 대기열에서 저장된 스트림 URL 확인
-        data = _load_data()
-        queue_item = next((q for q in data["queue"] if q["id"] == uid), None)
+        queue_item = _queue_find(uid)
         stream_url = queue_item.get("stream_url", "") if queue_item else ""
         stored_headers = queue_item.get("http_headers", {}) if queue_item else {}
 
@@ -2819,13 +4991,11 @@ def _do_download_worker(dl_item):
         if not stream_url and is_custom:
             print(f"  [다운로드] stream_url 없음 → 커스텀 추출기로 재추출")
             try:
-                re_info = _custom_extract(url)
+                re_info = _single_flight("extract", url, lambda: _custom_extract(url))
                 stream_url = re_info.get("url", "")
                 stored_headers = re_info.get("http_headers", {})
                 if queue_item and stream_url:
-                    queue_item["stream_url"] = stream_url
-                    queue_item["http_headers"] = stored_headers
-                    _save_data(data)
+                    _queue_update(uid, stream_url=stream_url, http_headers=stored_headers)
             except Exception as e:
                 print(f"  [다운로드] 재추출 실패: {e}")
 
@@ -2871,16 +5041,17 @@ def _do_download_worker(dl_item):
                 total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
                 downloaded = d.get("downloaded_bytes", 0)
                 speed = d.get("speed") or 0
+                fields = {}
+                if total > 0:
+                    fields["progress"] = round(downloaded / total * 100, 1)
+                if speed > 0:
+                    fields["speed"] = speed
                 with _download_lock:
-                    if total > 0:
-                        _download_status[uid]["progress"] = round(downloaded / total * 100, 1)
-                    if speed > 0:
-                        _download_status[uid]["speed"] = speed
+                    _download_set(uid, **fields)
             elif d["status"] == "finished":
                 out_filepath = d.get("filename", "")
                 with _download_lock:
-                    _download_status[uid]["progress"] = 100
-                    _download_status[uid]["filename"] = out_filepath
+                    _download_set(uid, progress=100, filename=out_filepath)
 
         opts["progress_hooks"] = [progress_hook]
 
@@ -2891,14 +5062,13 @@ def _do_download_worker(dl_item):
         _cleanup_temp_files(out_dir, safe_title)
 
         with _download_lock:
-            _download_status[uid]["status"] = "done"
+            _download_set(uid, status="done")
         print(f"  [다운로드] 완료: {title[:60]}")
 
     except Exception as e:
         print(f"  [다운로드] 오류: {title[:40]} — {e}")
         with _download_lock:
-            _download_status[uid]["status"] = "error"
-            _download_status[uid]["error"] = str(e)
+            _download_set(uid, status="error", error=str(e))
     finally:
         with _download_lock:
             _download_active -= 1
@@ -2936,15 +5106,13 @@ def start_download():
         return jsonify({"error": "이미 다운로드 중/대기 중입니다.", "id": uid}), 409
 
     # 제목 가져오기
-    data = _load_data()
-    queue_item = next((q for q in data["queue"] if q["id"] == uid), None)
+    queue_item = _queue_find(uid)
     title = queue_item.get("title", "video") if queue_item else "video"
 
     with _download_lock:
-        _download_status[uid] = {
-            "status": "queued", "progress": 0, "filename": "",
-            "error": "", "title": title, "url": url, "speed": 0,
-        }
+        _download_status[uid] = {}
+        _download_set(uid, status="queued", progress=0, filename="",
+                      error="", title=title, url=url, speed=0)
         _download_queue.append({"uid": uid, "url": url, "title": title})
     _process_download_queue()
 
@@ -2973,10 +5141,12 @@ def download_file(uid):
 @app.route("/api/download/clear-done", methods=["POST"])
 def clear_done_downloads():
     """완료/실패 다운로드 상태 정리"""
-    to_remove = [uid for uid, s in _download_status.items()
-                 if s.get("status") in ("done", "error")]
-    for uid in to_remove:
-        del _download_status[uid]
+    with _download_lock:
+        to_remove = [uid for uid, s in _download_status.items()
+                     if s.get("status") in ("done", "error")]
+        for uid in to_remove:
+            del _download_status[uid]
+            _publish_event("download", uid, None)
     return jsonify({"cleared": len(to_remove)})
 
 # ──────────────────────────────────────────────
@@ -3007,6 +5177,18 @@ def cookies_status():
     })
 
 
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    """메모리 캐시별 항목 수/바이트/적중률/내보냄 통계를 반환합니다."""
+    return jsonify({name: cache.stats() for name, cache in _CACHES.items()})
+
+
+@app.route("/api/pool/stats", methods=["GET"])
+def pool_stats():
+    """업스트림 연결 풀(CDN 요청용 requests 세션, 페이지용 curl_cffi 세션) 통계를 반환합니다."""
+    return jsonify({"upstream": _upstream_pool_snapshot(), "cf_sessions": _cf_pool_snapshot()})
+
+
 @app.route("/api/debug", methods=["POST"])
 def debug_url():
     """URL의 페이지를 가져와서 진단 정보를 반환합니다."""
@@ -3076,7 +5258,7 @@ def debug_url():
 
     # 페이지 가져오기
     try:
-        page, session, method = _fetch_page_with_cf_bypass(url)
+        page, _, method = _fetch_page_with_cf_bypass(url)
         result["method_used"] = method
         result["page_length"] = len(page)
 
@@ -3170,6 +5352,8 @@ def debug_url():
     except Exception as e:
         result["error"] = str(e)
 
+    # CF 우회 방법별 성공/실패 통계 + 다음 시도 순서
+    result["cf_methods"] = _cf_method_report(urllib.parse.urlparse(url).netloc)
     return jsonify(result)
 
 # ──────────────────────────────────────────────
@@ -3238,21 +5422,22 @@ def import_data():
         if not isinstance(imported, dict):
             return jsonify({"error": "유효하지 않은 데이터 형식입니다."}), 400
         # 기존 데이터와 병합 (queue, playback, heatmaps, settings)
-        data = _load_data()
-        if "queue" in imported:
+        with _data_lock:
             # 기존 큐에 없는 항목만 추가
-            existing_ids = {q["id"] for q in data.get("queue", [])}
-            for item in imported["queue"]:
-                if item.get("id") not in existing_ids:
-                    data.setdefault("queue", []).append(item)
-        if "playback" in imported:
-            data.setdefault("playback", {}).update(imported["playback"])
-        if "heatmaps" in imported:
-            data.setdefault("heatmaps", {}).update(imported["heatmaps"])
-        if "settings" in imported:
-            data["settings"] = {**DEFAULT_SETTINGS, **imported["settings"]}
-        _save_data(data)
-        return jsonify({"ok": True, "queue_count": len(data.get("queue", []))})
+            added = []
+            for item in imported.get("queue", []):
+                if item.get("id") and _queue_add(item) and not item.get("stream_url"):
+                    added.append((item["id"], item.get("url", "")))
+            for item_id, pb in imported.get("playback", {}).items():
+                if isinstance(pb, dict):
+                    _playback_set(item_id, pb.get("position", 0), pb.get("updated_at"))
+            for item_id, hm in imported.get("heatmaps", {}).items():
+                _heatmap_merge(item_id, hm)
+            if "settings" in imported:
+                _save_settings({**DEFAULT_SETTINGS, **imported["settings"]})
+        if added:
+            _preextract_enqueue(added, _PRE_PRIO_NEW)
+        return jsonify({"ok": True, "queue_count": len(_queue_ids())})
     except Exception as e:
         return jsonify({"error": f"가져오기 실패: {str(e)}"}), 400
 
@@ -3275,6 +5460,8 @@ def extract_cookies_now():
     """브라우저에서 쿠키를 직접 추출하여 cookies.txt로 저장합니다."""
     global _detected_browser
     _detected_browser = None  # 캐시 초기화
+    _cookie_jar_invalidate()
+    _cf_pool_reset()          # 새 쿠키로 세션을 다시 만들도록
     browser = _get_browser()
     if not browser:
         return jsonify({"ok": False, "error": "감지된 브라우저가 없습니다."}), 400
@@ -3333,29 +5520,32 @@ def extract_cookies_now():
 import atexit
 
 def _periodic_backup():
-    """5분마다 data.json을 자동 백업합니다."""
+    """5분마다 data.json 스냅샷을 자동 백업합니다."""
     import time as _time
     while True:
         _time.sleep(300)  # 5분
         try:
-            data = _load_data()
-            _save_data(data)
+            _write_json_snapshot()
             print("  [자동백업] 주기적 백업 완료")
         except Exception as e:
             print(f"  [자동백업] 실패: {e}")
 
 def _shutdown_save():
-    """프로그램 종료 시 최종 저장을 수행합니다."""
+    """프로그램 종료 시 남은 변경을 동기 플러시하고 최종 스냅샷을 씁니다."""
     try:
-        data = _load_data()
-        _save_data(data)
-        print("  [종료저장] 최종 저장 완료")
+        flushed = _flush_dirty()
+        _write_json_snapshot()
+        print(f"  [종료저장] 최종 저장 완료 (플러시 {flushed}건)")
     except Exception as e:
         print(f"  [종료저장] 실패: {e}")
 
 atexit.register(_shutdown_save)
 # 백업 스레드 시작
 threading.Thread(target=_periodic_backup, daemon=True, name="AutoBackup").start()
+# write-behind 플러셔 시작
+threading.Thread(target=_flusher_loop, daemon=True, name="DataFlusher").start()
+threading.Thread(target=_stream_refresh_loop, daemon=True, name="StreamRefresh").start()
+threading.Thread(target=_cache_sweeper_loop, daemon=True, name="CacheSweeper").start()
 
 # ──────────────────────────────────────────────
 # 메인
@@ -87,10 +87,15 @@
 
     // ── 상태 ──
     let queue = [];
+    let queueRev = 0;  // 서버 대기열 리비전 (GET /api/queue?since=)
     let currentItem = null;
     let currentIndex = -1;
-    let heatmapData = {};
+    let heatmapData = { buckets: [], bucket_sec: 1 };  // 서버에서 진행바 해상도로 다운샘플링한 값
     let heatmapInterval = null;
+    let heatmapPending = { itemId: null, seconds: [] };  // 서버로 보낼 히트맵 틱 버퍼
+    let heatmapLocal = new Map();  // 마지막 히트맵 조회 이후 기록한 틱 (초 → 횟수), 서버 값 위에 더해 그림
+    let heatmapLastFlush = 0;
+    const HEATMAP_FLUSH_MS = 30000;
     let savePositionInterval = null;
     let savedLastPosition = 0;
     let skipIndicatorTimeout = null;
@@ -202,10 +207,56 @@
     }
 
     // ── 대기열 ──
-    async function loadQueue() {
-        queue = await api('/api/queue');
+    // 목록 표시에 필요한 필드만 받음 (stream_url/http_headers 제외)
+    const QUEUE_FIELDS = 'id,url,title,thumbnail,duration,category,variants,added_at';
+    const QUEUE_PAGE_SIZE = 300;
+
+    async function loadQueue(attempt = 0) {
+        // 첫 페이지를 먼저 그리고, 나머지 페이지를 받은 뒤 한 번 더 그림
+        const pageUrl = (cursor) => `/api/queue?fields=${QUEUE_FIELDS}&limit=${QUEUE_PAGE_SIZE}`
+            + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : '');
+        let page = await api(pageUrl(null));
+        const rev = page.rev;
+        let items = page.items;
+        queue = items;
+        queueRev = rev;
         renderCategoryTabs();
         renderQueue();
+        if (!page.next_cursor) return;
+
+        while (page.next_cursor) {
+            page = await api(pageUrl(page.next_cursor));
+            // 페이지를 받는 도중 서버 대기열이 바뀌었으면(리비전 불일치) 목록이 어긋나므로 처음부터 다시
+            if (page.rev !== rev && attempt < 3) return loadQueue(attempt + 1);
+            items = items.concat(page.items);
+        }
+        queue = items;
+        queueRev = rev;
+        renderCategoryTabs();
+        renderQueue();
+    }
+
+    // 서버 변경분(델타)을 로컬 대기열에 반영. 실제로 바뀐 게 있으면 true
+    function applyQueueDelta(delta) {
+        const before = JSON.stringify(queue);
+        if (delta.full) {
+            queue = delta.items;
+        } else {
+            const byId = new Map(queue.map((q) => [q.id, q]));
+            const added = [];
+            delta.items.forEach((item) => {
+                if (!byId.has(item.id)) added.push(item);
+                byId.set(item.id, item);
+            });
+            (delta.removed || []).forEach((id) => byId.delete(id));
+            if (delta.order) {
+                queue = delta.order.map((id) => byId.get(id)).filter(Boolean);
+            } else {
+                queue = queue.filter((q) => byId.has(q.id)).map((q) => byId.get(q.id)).concat(added);
+            }
+        }
+        queueRev = delta.rev;
+        return JSON.stringify(queue) !== before;
     }
 
     // 다운로드 완료 ID 추적
@@ -382,21 +433,23 @@
             queueList.appendChild(el);
         });
 
-        // 재생 위치 배지 + 다운로드 완료 배지 로드
-        queue.forEach(async (item) => {
-            try {
-                const pb = await api(`/api/playback/${item.id}`);
-                if (pb.position > 0) {
-                    const el = queueList.querySelector(`[data-id="${item.id}"] .thumb`);
-                    if (el && !el.querySelector('.resume-badge')) {
-                        const badge = document.createElement('span');
-                        badge.className = 'resume-badge';
-                        badge.textContent = formatTime(pb.position);
-                        el.appendChild(badge);
-                    }
+        // 재생 위치 배지 로드 (한 번의 요청으로 전체 조회)
+        loadResumeBadges();
+    }
+
+    async function loadResumeBadges() {
+        try {
+            const { positions } = await api('/api/playback');
+            Object.entries(positions || {}).forEach(([id, position]) => {
+                const el = queueList.querySelector(`[data-id="${id}"] .thumb`);
+                if (el && !el.querySelector('.resume-badge')) {
+                    const badge = document.createElement('span');
+                    badge.className = 'resume-badge';
+                    badge.textContent = formatTime(position);
+                    el.appendChild(badge);
                 }
-            } catch { /* ignore */ }
-        });
+            });
+        } catch { /* ignore */ }
     }
 
     // 영상 정보 패널 표시 (고정 DOM 요소 사용)
@@ -748,6 +801,7 @@
 
         currentIndex = index;
         currentItem = queue[index];
+        warmedUpFor = null;
 
         overlay.classList.add('hidden');
 
@@ -888,10 +942,16 @@
     // ── 히트맵 ──
     async function loadHeatmap() {
         if (!currentItem) return;
+        const buckets = Math.min(1000, heatmapBar.clientWidth || 300);
+        const hasDuration = video.duration && video.duration !== Infinity;
+        const query = `buckets=${buckets}` + (hasDuration ? `&duration=${Math.ceil(video.duration)}` : '');
+        // 버퍼의 틱을 먼저 보내 응답에 포함시키고, 이후 기록분만 로컬에서 더함
+        await flushHeatmapTicks();
+        heatmapLocal = new Map();
         try {
-            heatmapData = await api(`/api/heatmap/${currentItem.id}`);
+            heatmapData = await api(`/api/heatmap/${currentItem.id}?${query}`);
         } catch {
-            heatmapData = {};
+            heatmapData = { buckets: [], bucket_sec: 1 };
         }
         renderHeatmap();
     }
@@ -900,18 +960,28 @@
         heatmapBar.innerHTML = '';
         if (!video.duration || video.duration === Infinity) return;
 
-        const keys = Object.keys(heatmapData);
-        if (keys.length === 0) return;
+        const bucketSec = heatmapData.bucket_sec || 1;
+        // 구간 값 = 구간 안 최대 초당 시청 수 → 로컬 틱은 구간별 최대 로컬 횟수를 더함 (상한 근사)
+        const buckets = [...(heatmapData.buckets || [])];
+        const extra = [];
+        heatmapLocal.forEach((count, sec) => {
+            const idx = Math.floor(sec / bucketSec);
+            extra[idx] = Math.max(extra[idx] || 0, count);
+        });
+        extra.forEach((count, idx) => {
+            while (buckets.length <= idx) buckets.push(0);
+            buckets[idx] += count;
+        });
+        if (buckets.length === 0) return;
 
-        const maxCount = Math.max(...keys.map((k) => heatmapData[k]));
+        const maxCount = Math.max(...buckets);
         if (maxCount <= 1) return;
 
-        keys.forEach((sec) => {
-            const count = heatmapData[sec];
+        buckets.forEach((count, i) => {
             if (count <= 1) return;
             const ratio = count / maxCount;
-            const left = (parseInt(sec) / video.duration) * 100;
-            const width = Math.max((1 / video.duration) * 100, 0.3);
+            const left = ((i * bucketSec) / video.duration) * 100;
+            const width = Math.max((bucketSec / video.duration) * 100, 0.3);
 
             const seg = document.createElement('div');
             seg.className = 'heatmap-segment';
@@ -926,19 +996,33 @@
         });
     }
 
-    async function recordHeatmapTick() {
+    function recordHeatmapTick() {
         if (!currentItem || video.paused || video.ended) return;
         const sec = Math.floor(video.currentTime);
-        try {
-            await api(`/api/heatmap/${currentItem.id}`, {
-                method: 'POST',
-                body: JSON.stringify({ second: sec }),
-            });
-            // 로컬 히트맵도 업데이트
-            const key = String(sec);
-            heatmapData[key] = (heatmapData[key] || 0) + 1;
-            renderHeatmap();
-        } catch { /* ignore */ }
+        if (heatmapPending.itemId !== currentItem.id) {
+            flushHeatmapTicks();
+            heatmapPending.itemId = currentItem.id;
+        }
+        heatmapPending.seconds.push(sec);
+        // 로컬 히트맵은 즉시 업데이트
+        heatmapLocal.set(sec, (heatmapLocal.get(sec) || 0) + 1);
+        renderHeatmap();
+        if (Date.now() - heatmapLastFlush >= HEATMAP_FLUSH_MS) flushHeatmapTicks();
+    }
+
+    // 모아 둔 틱을 한 번에 전송 (일시정지/항목 전환/페이지 이탈 시에도 호출). 전송 완료 Promise 반환
+    function flushHeatmapTicks(useBeacon = false) {
+        heatmapLastFlush = Date.now();
+        const { itemId, seconds } = heatmapPending;
+        if (!itemId || seconds.length === 0) return Promise.resolve();
+        heatmapPending = { itemId, seconds: [] };
+        const url = `/api/heatmap/${itemId}/batch`;
+        const body = JSON.stringify({ seconds });
+        if (useBeacon) {
+            navigator.sendBeacon(url, new Blob([body], { type: 'application/json' }));
+            return Promise.resolve();
+        }
+        return api(url, { method: 'POST', body }).catch(() => { /* ignore */ });
     }
 
     function showLastPositionMarker() {
@@ -962,6 +1046,7 @@
     }
 
     function clearTrackingIntervals() {
+        flushHeatmapTicks();
         if (heatmapInterval) clearInterval(heatmapInterval);
         if (savePositionInterval) clearInterval(savePositionInterval);
         heatmapInterval = null;
@@ -1026,17 +1111,36 @@
 
     document.addEventListener('mouseup', () => { isSeeking = false; });
 
+    // ── 다음 항목 예열 (autoplayNext: 끝나기 60초 전에 서버가 다음 항목 playlist/첫 세그먼트 준비) ──
+    const WARMUP_BEFORE_END = 60;
+    let warmedUpFor = null;
+
+    function maybeWarmupNext() {
+        if (!settings.autoplayNext || queue.length < 2 || !currentItem || warmedUpFor === currentItem.id) return;
+        if (!video.duration || !isFinite(video.duration)) return;
+        if (video.duration - video.currentTime > WARMUP_BEFORE_END) return;
+        warmedUpFor = currentItem.id;
+        const next = queue[(currentIndex + 1) % queue.length];
+        if (next && next.id !== currentItem.id) {
+            api(`/api/queue/${next.id}/warmup`, { method: 'POST' }).catch(() => { });
+        }
+    }
+
     // ── 비디오 이벤트 ──
     video.addEventListener('timeupdate', updateProgress);
+    video.addEventListener('timeupdate', maybeWarmupNext);
     video.addEventListener('progress', updateBuffered);
     video.addEventListener('loadedmetadata', () => {
         updateProgress();
         showLastPositionMarker();
-        renderHeatmap();
+        loadHeatmap();  // 길이를 알게 되면 진행바 기준 구간으로 다시 받기
     });
 
     video.addEventListener('play', () => { btnPlay.textContent = '⏸'; });
-    video.addEventListener('pause', () => { btnPlay.textContent = '▶'; });
+    video.addEventListener('pause', () => {
+        btnPlay.textContent = '▶';
+        flushHeatmapTicks();
+    });
 
     video.addEventListener('ended', () => {
         btnPlay.textContent = '▶';
@@ -1257,33 +1361,33 @@
                 }
 
                 const clipId = result.id;
-                const pollInterval = setInterval(async () => {
-                    try {
-                        const st = await api(`/api/clip-status/${clipId}`);
-                        switch (st.status) {
-                            case 'preparing':
-                            case 'extracting':
-                                clipStatus.textContent = '⏳ 스트림 분석 중...';
-                                break;
-                            case 'downloading':
-                                const detail = st.detail || '';
-                                const pct = st.progress || 0;
-                                clipStatus.textContent = `⬇️ ${detail} (${pct}%)`;
-                                break;
-                            case 'done':
-                                clearInterval(pollInterval);
-                                const sizeMB = st.size ? (st.size / 1024 / 1024).toFixed(1) : '?';
-                                clipStatus.textContent = `✅ 완료! (${sizeMB}MB)`;
-                                clipDownloadBtn.disabled = false;
-                                break;
-                            case 'error':
-                                clearInterval(pollInterval);
-                                clipStatus.textContent = `❌ ${(st.error || '오류').substring(0, 60)}`;
-                                clipDownloadBtn.disabled = false;
-                                break;
-                        }
-                    } catch { /* ignore */ }
-                }, 2000);
+                const onClipStatus = (st) => {
+                    switch (st.status) {
+                        case 'preparing':
+                        case 'extracting':
+                            clipStatus.textContent = '⏳ 스트림 분석 중...';
+                            break;
+                        case 'downloading':
+                            const detail = st.detail || '';
+                            const pct = st.progress || 0;
+                            clipStatus.textContent = `⬇️ ${detail} (${pct}%)`;
+                            break;
+                        case 'done':
+                            delete clipWatchers[clipId];
+                            const sizeMB = st.size ? (st.size / 1024 / 1024).toFixed(1) : '?';
+                            clipStatus.textContent = `✅ 완료! (${sizeMB}MB)`;
+                            clipDownloadBtn.disabled = false;
+                            break;
+                        case 'error':
+                            delete clipWatchers[clipId];
+                            clipStatus.textContent = `❌ ${(st.error || '오류').substring(0, 60)}`;
+                            clipDownloadBtn.disabled = false;
+                            break;
+                    }
+                };
+                // 진행 상황은 /api/events 구독으로 수신
+                clipWatchers[clipId] = onClipStatus;
+                if (clipState[clipId]) onClipStatus(clipState[clipId]);
             } catch (err) {
                 clipStatus.textContent = `❌ ${err.message}`;
                 clipDownloadBtn.disabled = false;
@@ -1336,51 +1440,90 @@
             setTimeout(() => showStatus(''), 3000);
 
             // 다운로드 진행 표시 시작
-            startDownloadPolling(result.id);
+            watchDownload(result.id);
         } catch (err) {
             showStatus(`❌ ${err.message}`, 'error');
         }
     });
 
-    // 다운로드 상태 폴링 (다중 동시 지원)
-    let downloadPolls = {};
+    // ── 서버 이벤트 (SSE) — 다운로드/구간 다운로드 진행 상황을 한 연결로 수신 ──
+    let downloadStatus = {};              // uid -> 다운로드 상태 (이벤트로 갱신)
+    const clipState = {};                 // clipId -> 구간 다운로드 상태
+    const clipWatchers = {};              // clipId -> 상태 콜백
+    const watchedDownloads = new Set();   // 이 창에서 시작해 완료 처리가 필요한 다운로드
+
+    const serverEvents = new EventSource('/api/events');
+    serverEvents.addEventListener('snapshot', (e) => {
+        const snap = JSON.parse(e.data);
+        // 서버 snapshot의 끝난 작업은 일정 시간만 남음 → 이미 받아 둔 끝난 작업(done/error)은 재연결해도 유지
+        const finished = Object.fromEntries(Object.entries(downloadStatus)
+            .filter(([, s]) => s.status === 'done' || s.status === 'error'));
+        downloadStatus = { ...finished, ...(snap.downloads || {}) };
+        Object.assign(clipState, snap.clips || {});
+        Object.keys(clipWatchers).forEach((id) => {
+            if (clipState[id]) clipWatchers[id](clipState[id]);
+            else refetchJobStatus(`/api/clip-status/${id}`, (s) => { clipState[id] = s; clipWatchers[id]?.(s); });
+        });
+        if (watchedDownloads.size > 0) {
+            watchedDownloads.forEach((uid) => {
+                if (downloadStatus[uid]) return;
+                refetchJobStatus(`/api/download/status/${uid}`, (s) => {
+                    downloadStatus[uid] = s;
+                    onDownloadUpdate(uid);
+                    renderDownloadList(downloadStatus);
+                });
+            });
+            watchedDownloads.forEach(onDownloadUpdate);
+            renderDownloadList(downloadStatus);
+        }
+    });
 
-    function startDownloadPolling(uid) {
-        if (downloadPolls[uid]) return;
+    // snapshot에 없는 (오래전에 끝난) 지켜보던 작업은 상태 API로 한 번 확인
+    async function refetchJobStatus(url, apply) {
+        try {
+            const s = await api(url);
+            if (s && s.status && s.status !== 'not_found' && s.status !== 'unknown') apply(s);
+        } catch { /* ignore */ }
+    }
+    serverEvents.addEventListener('download', (e) => {
+        const msg = JSON.parse(e.data);
+        const relevant = watchedDownloads.has(msg.id) || downloadPanel.style.display === 'block';
+        if (msg.removed) delete downloadStatus[msg.id];
+        else downloadStatus[msg.id] = { ...(downloadStatus[msg.id] || {}), ...msg.data };
+        onDownloadUpdate(msg.id);
+        if (relevant) renderDownloadList(downloadStatus);
+    });
+    serverEvents.addEventListener('clip', (e) => {
+        const msg = JSON.parse(e.data);
+        clipState[msg.id] = { ...(clipState[msg.id] || {}), ...msg.data };
+        if (clipWatchers[msg.id]) clipWatchers[msg.id](clipState[msg.id]);
+    });
 
+    function watchDownload(uid) {
+        watchedDownloads.add(uid);
         downloadPanel.style.display = 'block';
+        onDownloadUpdate(uid);
+        renderDownloadList(downloadStatus);
+    }
 
-        downloadPolls[uid] = setInterval(async () => {
-            try {
-                const allStatus = await api('/api/download/all-status');
-                renderDownloadList(allStatus);
-
-                const s = allStatus[uid];
-                if (!s) return;
+    function onDownloadUpdate(uid) {
+        const s = downloadStatus[uid];
+        if (!s || !watchedDownloads.has(uid)) return;
 
-                if (s.status === 'done') {
-                    clearInterval(downloadPolls[uid]);
-                    delete downloadPolls[uid];
-                    downloadedIds.add(uid);
-                    renderQueue();
-                    renderDownloadList(allStatus);
-                    // 파일 다운로드 트리거
-                    const a = document.createElement('a');
-                    a.href = `/api/download/file/${uid}`;
-                    a.download = '';
-                    document.body.appendChild(a);
-                    a.click();
-                    a.remove();
-                } else if (s.status === 'error') {
-                    clearInterval(downloadPolls[uid]);
-                    delete downloadPolls[uid];
-                    renderDownloadList(allStatus);
-                }
-            } catch {
-                clearInterval(downloadPolls[uid]);
-                delete downloadPolls[uid];
-            }
-        }, 1500);
+        if (s.status === 'done') {
+            watchedDownloads.delete(uid);
+            downloadedIds.add(uid);
+            renderQueue();
+            // 파일 다운로드 트리거
+            const a = document.createElement('a');
+            a.href = `/api/download/file/${uid}`;
+            a.download = '';
+            document.body.appendChild(a);
+            a.click();
+            a.remove();
+        } else if (s.status === 'error') {
+            watchedDownloads.delete(uid);
+        }
     }
 
     function renderDownloadList(allStatus) {
@@ -1400,7 +1543,7 @@
             }
         }
 
-        if (active.length === 0 && Object.keys(downloadPolls).length === 0) {
+        if (active.length === 0 && watchedDownloads.size === 0) {
             if (done.length > 0 || errors.length > 0) {
                 downloadList.innerHTML = entries.map(([id, s]) => _renderDlItem(id, s)).join('');
                 setTimeout(() => { downloadPanel.style.display = 'none'; }, 8000);
@@ -1473,8 +1616,7 @@
         dlClearDone.addEventListener('click', async () => {
             try {
                 await api('/api/download/clear-done', { method: 'POST' });
-                const allStatus = await api('/api/download/all-status');
-                renderDownloadList(allStatus);
+                renderDownloadList(downloadStatus);
             } catch { /* ignore */ }
         });
     }
@@ -1548,7 +1690,7 @@
                             showStatus(`❌ ${result.error}`, 'error');
                         } else {
                             showStatus(`⬇️ 다운로드: ${result.title || ''}`, 'success');
-                            startDownloadPolling(result.id);
+                            watchDownload(result.id);
                         }
                         setTimeout(() => showStatus(''), 3000);
                     } catch (err) {
@@ -1688,6 +1830,7 @@
 
     // ── 페이지 나갈 때 위치 저장 ──
     window.addEventListener('beforeunload', () => {
+        flushHeatmapTicks(true);
         if (currentItem && video.currentTime > 0) {
             // 동기 저장 (beacon)
             navigator.sendBeacon(
@@ -1702,6 +1845,10 @@
         } catch { /* ignore */ }
     });
 
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') flushHeatmapTicks(true);
+    });
+
     // ── HTML 이스케이프 ──
     function escapeHtml(str) {
         const div = document.createElement('div');
@@ -1746,6 +1893,19 @@
                 if (d.method_used) {
                     html += `<div><span class="diag-label">접근 방식:</span> ${escapeHtml(d.method_used)}</div>`;
                 }
+                // CF 우회 방법 통계 (성공/실패, 백오프)
+                if (d.cf_methods && d.cf_methods.order) {
+                    const stats = d.cf_methods.methods || {};
+                    const parts = d.cf_methods.order.map(m => {
+                        const st = stats[m];
+                        return st ? `${m} ${st.ok}✓/${st.fail}✗` : m;
+                    });
+                    const waiting = Object.entries(stats).filter(([, st]) => st.backoff_sec > 0)
+                        .map(([m, st]) => `${m} ${st.backoff_sec}초 대기`);
+                    html += `<div><span class="diag-label">우회 순서:</span> ${escapeHtml(parts.join(' → '))}`;
+                    if (waiting.length) html += ` <span style="font-size:11px;color:#aaa">(${escapeHtml(waiting.join(', '))})</span>`;
+                    html += `</div>`;
+                }
                 // 브라우저 쿠키
                 html += `<div><span class="diag-label">브라우저 쿠키:</span> `;
                 if (d.browser_cookie_count > 0) {
@@ -2073,18 +2233,25 @@
         }
     });
 
-    // ── 외부 추가 감지 (탐색 창에서 추가 시 반영, 포커스 시에만) ──
-    setInterval(async () => {
-        if (document.hidden) return;  // 비활성 탭이면 스킵
-        try {
-            const serverQueue = await api('/api/queue');
-            if (serverQueue.length !== queue.length) {
-                queue = serverQueue;
-                renderCategoryTabs();
-                renderQueue();
+    // ── 외부 변경 감지 (탐색 창에서 추가 등) — 리비전 기반 long-poll ──
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+    // 첫 loadQueue()가 리비전을 정한 뒤에 시작 (since=0이면 전체 목록이 와서 페이지 단위 첫 렌더가 무의미)
+    async function watchQueue() {
+        for (;;) {
+            if (document.hidden) { await sleep(5000); continue; }  // 비활성 탭이면 대기
+            try {
+                const res = await fetch(`/api/queue?since=${queueRev}&wait=25&fields=${QUEUE_FIELDS}`);
+                if (res.status === 304) continue;
+                if (!res.ok) throw new Error(res.statusText);
+                if (applyQueueDelta(await res.json())) {
+                    renderCategoryTabs();
+                    renderQueue();
+                }
+            } catch {
+                await sleep(5000);
             }
-        } catch { /* ignore */ }
-    }, 5000);
+        }
+    }
 
     // ──────────────────────────────────────────
     // 대기열 관리 — 스크롤, 다중 선택, 벌크 액션
@@ -2405,7 +2572,8 @@
     loadSettings().then(async () => {
         checkCookies();
         await loadCategories();
-        await loadQueue();
+        await loadQueue().catch(() => { /* watchQueue가 다시 받음 */ });
+        watchQueue();
 
         // 마지막 재생 항목 복원
         try {
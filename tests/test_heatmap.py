@@ -0,0 +1,34 @@
+"""히트맵 다운샘플링 (_hm_buckets) 테스트. 실행: python -m unittest discover tests"""
+import unittest
+from array import array
+
+import server
+
+
+class HeatmapBucketsTest(unittest.TestCase):
+    def test_long_span_keeps_rewatched_region(self):
+        # 2시간 영상을 300칸으로 → 구간 하나가 24초. 2초 간격 틱으로 두 번 본 구간은 값 2 (프론트 기준 "> 1")
+        arr = array("I", [0] * 7200)
+        for sec in range(3600, 3620, 2):
+            arr[sec] = 2
+        buckets, width = server._hm_buckets(arr, 300, 7200)
+        self.assertEqual(width, 24)
+        self.assertEqual(len(buckets), 300)
+        self.assertEqual(buckets[150], 2)
+        self.assertEqual(max(buckets), 2)
+
+    def test_bucket_value_is_max_second(self):
+        arr = array("I", [1, 5, 0, 3, 1, 1])
+        buckets, width = server._hm_buckets(arr, 2, 6)
+        self.assertEqual((buckets, width), ([5, 3], 3))
+
+    def test_short_span_is_per_second(self):
+        arr = array("I", [0, 2, 0])
+        self.assertEqual(server._hm_buckets(arr, 100, 3), ([0, 2, 0], 1.0))
+
+    def test_empty(self):
+        self.assertEqual(server._hm_buckets(array("I"), 100), ([], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()